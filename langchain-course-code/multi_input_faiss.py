@@ -5,6 +5,7 @@ from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from langchain.vectorstores import FAISS
 from langchain.embeddings import OpenAIEmbeddings
+from rag_helpers.embedding_cache import CachedEmbeddings
 from langchain.schema import Document
 from pydantic import BaseModel, Field
 from typing import List
@@ -61,7 +62,7 @@ for email in emails:
     documents.append(Document(page_content=doc_text, metadata={"email_date": parsed.date}))
 
 # ==== Store in Vector DB (FAISS) ====
-embeddings = OpenAIEmbeddings()
+embeddings = CachedEmbeddings(OpenAIEmbeddings())
 vectorstore = FAISS.from_documents(documents, embeddings)
 
 # ==== Test Vector Search ====
@@ -1,39 +1,95 @@
+import time
 import streamlit as st
 from helpers import *
+from jobs import JobQueue
+
+
+# one worker pool + job table per process, shared by every session
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
 
 
 def main():
     st.set_page_config(page_title="Bill Extractor")
     st.title("Bill Extractor AI Assistant...🤖")
-    
+    job_queue = get_job_queue()
+
+    # extraction settings (see create_docs in helpers.py)
+    with st.sidebar:
+        requests_per_minute = st.number_input("LLM requests per minute (0 = no limit)",
+                                              min_value=0, value=0, step=10)
+        max_prompt_tokens = st.number_input("Max bill tokens per request", min_value=200,
+                                            value=PROMPT_TOKEN_BUDGET, step=100)
+        # bills of a bulk upload go several per LLM request, up to this much bill text
+        pack_tokens = st.number_input("Bill tokens per packed request (0 = one bill per request)",
+                                      min_value=0, value=3000, step=500)
+    job_queue.set_requests_per_minute(requests_per_minute or None)
+
     # Upload Bills
     pdf_files = st.file_uploader("Upload your bills in PDF format only",
                                  type=["pdf"],
                                  accept_multiple_files=True)
     extract_button = st.button("Extract bill data...")
-    
-    if extract_button:
-        with st.spinner("Extracting... it takes time..."):
-            data_frame = create_docs(pdf_files)
-            st.write(data_frame.head())
-            data_frame["AMOUNT"] = data_frame["AMOUNT"].astype(float)
-            st.write("Average bill amount: ", data_frame['AMOUNT'].mean())
-            
-            # convert to csv
-            convert_to_csv = data_frame.to_csv(index=False).encode("utf-8")
-            
-            
-            st.download_button(
-                "Download data as CSV",
-                convert_to_csv,
-                "CSV_Bills.csv",
-                "text/csv",
-                key="download-csv"
-            )
+
+    # Extraction runs in the background (see jobs.py); the job id goes in the
+    # URL so a browser refresh picks the same job up again
+    if extract_button and pdf_files:
+        st.query_params["job"] = job_queue.submit(pdf_files, max_prompt_tokens=max_prompt_tokens,
+                                                  pack_tokens=pack_tokens)
+    job_id = st.query_params.get("job")
+
+    if job_id:
+        files = job_queue.status(job_id)
+        finished = sum(f['status'] in ('done', 'failed') for f in files)  # not pending/waiting
+        st.progress(finished / max(len(files), 1),
+                    text=f"Extracted {finished} of {len(files)} bills...")
+        for f in files:
+            if f['status'] == 'failed':
+                st.warning(f"{f['name']}: {f['error']}")
+            elif f['status'] == 'running' and f['partial']:
+                # fields of a bill still being extracted, as they stream in
+                st.caption(f"{f['name']}: " + ", ".join(f"{key}: {value}" for key, value
+                                                       in f['partial'].items()))
+
+        data_frame = job_queue.to_frame(job_id)
+        st.write(data_frame.head())
+        # AMOUNT is already numeric (see BillAccumulator in helpers.py)
+        st.write("Average bill amount: ", data_frame['AMOUNT'].mean())
+
+        if finished < len(files):
+            # poll the job table until every file is done
+            time.sleep(1)
+            st.rerun()
+
+        # convert to csv
+        convert_to_csv = data_frame.to_csv(index=False).encode("utf-8")
+
+
+        st.download_button(
+            "Download data as CSV",
+            convert_to_csv,
+            "CSV_Bills.csv",
+            "text/csv",
+            key="download-csv"
+        )
+        # compact, typed columnar downloads - if one can't be built, the page
+        # (and the CSV) still work
+        for label, export, file_name, mime, key in [
+                ("Parquet", to_parquet_bytes, "Bills.parquet",
+                 "application/vnd.apache.parquet", "download-parquet"),
+                ("Arrow", to_arrow_bytes, "Bills.arrow",
+                 "application/vnd.apache.arrow.stream", "download-arrow")]:
+            try:
+                data = export(data_frame)
+            except Exception as e:
+                st.warning(f"{label} download unavailable: {e}")
+                continue
+            st.download_button(f"Download data as {label}", data, file_name, mime, key=key)
         st.success("Success!!")
-            
-    
+
+
 
 #Invoking main function
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import helpers
+from helpers import BILL_COLUMNS, BillAccumulator, create_docs, extraction_prompt
+from prune import prune_text
+from stream_parser import DictStreamParser
+from templates import TemplateExtractor, _number
+
+# Offline benchmark for the bill extractor: no OpenAI calls, no API key.
+#
+#   python benchmark.py                            # sample bills + 50 synthetic ones
+#   python benchmark.py --synthetic 500 --latency 0.8 --workers 8 --pack-tokens 3000
+#   python benchmark.py --json results.json        # keep the numbers for comparison
+#
+# The LLM is replaced by FakeLLM, which answers from the prompt it is given
+# (so what pruning drops, it can't see) after a fixed, seeded latency. Every run
+# gets fresh page/record caches and an empty template store, so nothing carries
+# over between runs. Two passes are made over the same bills:
+#   stages   - one bill at a time: PDF parse, prompt build, LLM, parse, DataFrame
+#   pipeline - create_docs() as the app calls it, for docs/sec and field accuracy
+# Field accuracy needs the true values, so it only covers the synthetic bills;
+# the sample bills in data/ are timed but not scored.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# the labels a bill might print in front of each field - the synthetic bills
+# use them, and FakeLLM looks for them
+FIELD_LABELS = {
+    'Invoice ID': ['Invoice ID', 'Invoice #', 'Invoice No.'],
+    'DESCRIPTION': ['Description', 'Item', 'Service'],
+    'Issue Date': ['Issue Date', 'Date Issued', 'Invoice Date'],
+    'UNIT PRICE': ['Unit Price', 'Rate', 'Price per unit'],
+    'AMOUNT': ['Amount', 'Total Due', 'Amount Due'],
+    'Bill For': ['Bill For', 'Bill To', 'Billed To'],
+    'From': ['From', 'Company', 'Provider'],
+    'Terms': ['Terms', 'Payment Terms', 'Terms of Payment'],
+}
+
+_DESCRIPTIONS = ['Monthly rent', 'Water and sewer service', 'Mobile phone plan',
+                 'Consulting services', 'Electricity usage', 'Internet service']
+_NAMES = ['James Smith', 'Maria Garcia', 'Li Wei', 'Amina Okafor', 'Noah Brown']
+_COMPANIES = ['Excel Company', 'City Utilities', 'Northwind Telecom', 'Acme Rentals']
+_TERMS = ['Pay within 30 days', 'Due on receipt', 'Net 15', 'Late fee after 10 days']
+_FILLER = ['Thank you for your business.',
+           'Please keep this page for your records.',
+           'Questions about this statement? Call our office during business hours.',
+           'Visit our website to sign up for paperless statements.',
+           'This notice was generated electronically and is valid without signature.']
+
+
+# A minimal PDF writer (Helvetica, one text line per row, 50 rows per page) -
+# just enough for pypdf to read back the same text as a real bill
+def write_pdf(path, lines, lines_per_page=50):
+    def escape(line):
+        return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    pages = [lines[n:n + lines_per_page] for n in range(0, len(lines), lines_per_page)] or [[]]
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for page in pages:
+        text = ''.join(f'({escape(line)}) Tj T*\n' for line in page)
+        stream = f'BT /F1 11 Tf 14 TL 50 760 Td\n{text}ET'
+        objects.append(f'<< /Length {len(stream.encode("latin-1"))} >>\n'
+                       f'stream\n{stream}\nendstream')
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>')
+        page_ids.append(len(objects))
+    objects[1] = (f'<< /Type /Pages /Kids [{" ".join(f"{n} 0 R" for n in page_ids)}] '
+                  f'/Count {len(page_ids)} >>')
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for n, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f'{n} 0 obj\n{body}\nendobj\n'.encode('latin-1'))
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1'))
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode('latin-1'))
+    out.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n'
+              f'startxref\n{xref}\n%%EOF\n'.encode('latin-1'))
+    with open(path, 'wb') as f:
+        f.write(out.getvalue())
+
+
+# Write `count` bills to `out_dir` in a few different layouts (label wording and
+# field order), each padded with `filler_lines` of boilerplate so prompt pruning
+# has something to do. Returns [(path, true values)].
+def make_synthetic_bills(out_dir, count, seed=0, layouts=3, filler_lines=20):
+    rng = random.Random(seed)
+    bills = []
+    for n in range(count):
+        layout = n % layouts
+        quantity = rng.randint(1, 5)
+        unit_price = rng.randint(20, 2000) + rng.choice([0, 0.5, 0.99])
+        truth = {'Invoice ID': str(1000000 + rng.randint(0, 8999999)),
+                 'DESCRIPTION': rng.choice(_DESCRIPTIONS),
+                 'Issue Date': f'{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(2019, 2024)}',
+                 'UNIT PRICE': f'{unit_price:.2f}',
+                 'AMOUNT': round(quantity * unit_price, 2),
+                 'Bill For': rng.choice(_NAMES),
+                 'From': rng.choice(_COMPANIES),
+                 'Terms': rng.choice(_TERMS)}
+        printed = dict(truth, **{'UNIT PRICE': f'${unit_price:,.2f}',
+                                 'AMOUNT': f'${truth["AMOUNT"]:,.2f}'})
+        fields = list(FIELD_LABELS)
+        random.Random(layout).shuffle(fields)
+        lines = [printed['From'].upper(), 'INVOICE', '']
+        lines += [f'{FIELD_LABELS[field][layout % 3]}: {printed[field]}' for field in fields]
+        lines += [rng.choice(_FILLER) for _ in range(filler_lines)]
+        path = os.path.join(out_dir, f'synthetic-{n:05d}.pdf')
+        write_pdf(path, lines)
+        bills.append((path, truth))
+    return bills
+
+
+# Deterministic stand-in for the OpenAI LLM in helpers.py. It "reads" the bill
+# text in the prompt by looking for the labels in FIELD_LABELS, waits `latency`
+# seconds (+/- `jitter`, seeded by the prompt, so reruns are identical) and
+# streams its answer in `chunk_size` character pieces like the real one does.
+class FakeLLM:
+
+    def __init__(self, latency=0.5, jitter=0.0, chunk_size=4):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _wait(self, prompt):
+        with self.lock:
+            self.requests += 1
+        seed = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+        delay = self.latency + random.Random(seed).uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, delay))
+
+    def _read(self, text):
+        values = {}
+        for field, labels in FIELD_LABELS.items():
+            for label in labels:
+                match = re.search(r'^[ \t]*' + re.escape(label) + r'[ \t]*:[ \t]*(.+?)[ \t]*$',
+                                  text, re.MULTILINE)
+                if match:
+                    values[field] = match.group(1).replace('$', '')
+                    break
+        return values
+
+    def _chunks(self, response):
+        for n in range(0, len(response), self.chunk_size):
+            yield response[n:n + self.chunk_size]
+
+    # same signature as helpers.stream_extracted_data
+    def stream_extracted_data(self, pages_data):
+        self._wait(extraction_prompt(pages_data))
+        yield from self._chunks('\n\n' + repr(self._read(pages_data)))
+
+    # same signature as helpers.extracted_data_packed
+    def extracted_data_packed(self, pages_list):
+        self._wait(''.join(pages_list))
+        return repr([dict({'doc': n}, **self._read(pages))
+                     for n, pages in enumerate(pages_list, 1)])
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def same_value(field, found, expected):
+    if found is None or (isinstance(found, float) and found != found):  # None / NaN
+        return False
+    if BILL_COLUMNS[field] != 'string':
+        return abs(float(found) - float(expected)) < 0.005
+    # '1,100.00' and '1100.00' are the same price
+    found_number, expected_number = _number(str(found)), _number(str(expected))
+    if found_number is not None and expected_number is not None:
+        return abs(found_number - expected_number) < 0.005
+    return str(found).strip().lower() == str(expected).strip().lower()
+
+
+# share of the true field values found in the extracted rows (matched up by
+# Invoice ID; a bill with no row scores zero)
+def field_accuracy(rows, truths):
+    by_id = {str(row.get('Invoice ID')).strip(): row for row in rows}
+    per_field = {field: 0 for field in BILL_COLUMNS}
+    for truth in truths:
+        row = by_id.get(truth['Invoice ID'], {})
+        for field, expected in truth.items():
+            per_field[field] += same_value(field, row.get(field), expected)
+    total = max(len(truths), 1)
+    return {field: hits / total for field, hits in per_field.items()}
+
+
+# point helpers.py at throwaway caches and the fake LLM
+@contextlib.contextmanager
+def offline_extractor(llm, work_dir):
+    saved = {name: getattr(helpers, name) for name in
+             ('PAGES_CACHE_DIR', 'RECORDS_CACHE_DIR', 'bill_templates',
+              'stream_extracted_data', 'extracted_data_packed')}
+    helpers.PAGES_CACHE_DIR = os.path.join(work_dir, 'pages')
+    helpers.RECORDS_CACHE_DIR = os.path.join(work_dir, 'records')
+    helpers.bill_templates = TemplateExtractor(BILL_COLUMNS,
+                                               path=os.path.join(work_dir, 'templates.json'))
+    helpers.stream_extracted_data = llm.stream_extracted_data
+    helpers.extracted_data_packed = llm.extracted_data_packed
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(helpers, name, value)
+
+
+# one bill at a time, timing each stage of the LLM path (templates are empty
+# in this pass, so every bill goes through all of them)
+def run_stages(paths, llm, max_prompt_tokens):
+    timings = {stage: [] for stage in ('pdf_parse', 'prompt_build', 'llm', 'parse')}
+    bills = BillAccumulator()
+    for path in paths:
+        start = time.perf_counter()
+        _, pages = helpers.get_pdf_pages(path)
+        parsed = time.perf_counter()
+        pages_data, _ = prune_text(''.join(pages), max_prompt_tokens)
+        extraction_prompt(pages_data)
+        built = time.perf_counter()
+        response = ''.join(llm.stream_extracted_data(pages_data))
+        answered = time.perf_counter()
+        data_dict = DictStreamParser(schema=BILL_COLUMNS).parse(response)
+        done = time.perf_counter()
+        bills.add(data_dict)
+        for stage, seconds in zip(timings, (parsed - start, built - parsed,
+                                            answered - built, done - answered)):
+            timings[stage].append(seconds)
+    start = time.perf_counter()
+    bills.to_frame()
+    timings['dataframe'] = [time.perf_counter() - start]
+    return timings
+
+
+def run_benchmark(synthetic=50, samples=True, latency=0.5, jitter=0.0, workers=4,
+                  pack_tokens=None, max_prompt_tokens=helpers.PROMPT_TOKEN_BUDGET,
+                  filler_lines=20, seed=0):
+    work_dir = tempfile.mkdtemp(prefix='extractor-bench-')
+    try:
+        bills_dir = os.path.join(work_dir, 'bills')
+        os.makedirs(bills_dir)
+        generated = make_synthetic_bills(bills_dir, synthetic, seed, filler_lines=filler_lines)
+        paths = sorted(glob.glob(os.path.join(DATA_DIR, '*.pdf'))) if samples else []
+        paths += [path for path, _ in generated]
+        truths = [truth for _, truth in generated]
+
+        llm = FakeLLM(latency, jitter)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with offline_extractor(llm, os.path.join(work_dir, 'stages')):
+                timings = run_stages(paths, llm, max_prompt_tokens)
+
+            llm.requests = 0
+            with offline_extractor(llm, os.path.join(work_dir, 'pipeline')):
+                start = time.perf_counter()
+                df = create_docs(paths, max_workers=workers, max_prompt_tokens=max_prompt_tokens,
+                                 pack_tokens=pack_tokens)
+                elapsed = time.perf_counter() - start
+
+        rows = df.astype(object).where(df.notna(), None).to_dict('records')
+        return {
+            'docs': len(paths),
+            'rows': len(rows),
+            'seconds': elapsed,
+            'docs_per_sec': len(paths) / elapsed if elapsed else 0.0,
+            'llm_requests': llm.requests,
+            'stages': {stage: {'p50': percentile(values, 50), 'p95': percentile(values, 95),
+                               'total': sum(values)}
+                       for stage, values in timings.items()},
+            'field_accuracy': field_accuracy(rows, truths),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(results):
+    print(f"{results['docs']} bills -> {results['rows']} rows in {results['seconds']:.2f}s "
+          f"({results['docs_per_sec']:.2f} docs/sec, {results['llm_requests']} LLM requests)")
+    print(f"\n{'stage':<14}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for stage, stats in results['stages'].items():
+        print(f"{stage:<14}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}"
+              f"{stats['total']:>10.2f}")
+    accuracy = results['field_accuracy']
+    print(f"\n{'field':<14}{'accuracy':>10}")
+    for field, score in accuracy.items():
+        print(f"{field:<14}{score:>10.1%}")
+    print(f"{'overall':<14}{sum(accuracy.values()) / len(accuracy):>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the bill extractor")
+    parser.add_argument('--synthetic', type=int, default=50, help="synthetic bills to generate")
+    parser.add_argument('--no-samples', action='store_true', help="skip the bills in data/")
+    parser.add_argument('--latency', type=float, default=0.5, help="fake LLM seconds per request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- seconds around --latency")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--pack-tokens', type=int, default=None)
+    parser.add_argument('--max-prompt-tokens', type=int, default=helpers.PROMPT_TOKEN_BUDGET)
+    parser.add_argument('--filler-lines', type=int, default=20,
+                        help="boilerplate lines per synthetic bill")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.synthetic, not args.no_samples, args.latency, args.jitter,
+                            args.workers, args.pack_tokens, args.max_prompt_tokens,
+                            args.filler_lines, args.seed)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,382 @@
 from langchain.llms import OpenAI
 from pypdf import PdfReader
 import pandas as pd
-import re
 from langchain.prompts import PromptTemplate
 from langchain.chat_models import ChatOpenAI
 from langchain.agents.agent_types import AgentType
 
 import openai
+import hashlib
+import io
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import find_dotenv, load_dotenv
+from templates import TemplateExtractor
+from prune import count_tokens, prune_text
+from stream_parser import DictStreamParser, coerce_field, parse_dict_list
 load_dotenv(find_dotenv())
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # chat = ChatOpenAI(temperature=.7, model="gpt-3.5-turbo")
 
+# most tokens of bill text we send to the LLM per document (see prune.py)
+PROMPT_TOKEN_BUDGET = 1500
+
+# On-disk caches keyed by the sha256 of the PDF bytes: the text of each page,
+# and the record we extracted from it
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+PAGES_CACHE_DIR = os.path.join(CACHE_DIR, 'pages')
+RECORDS_CACHE_DIR = os.path.join(CACHE_DIR, 'records')
+
+def read_cache(cache_dir, digest):
+    path = os.path.join(cache_dir, digest + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_cache(cache_dir, digest, value):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, digest + '.json')
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, default=str)
+    os.replace(tmp_path, path)
+
+# raw bytes of an uploaded file (streamlit UploadedFile), file object or path
+def read_pdf_bytes(pdf_doc):
+    if hasattr(pdf_doc, 'getvalue'):
+        return pdf_doc.getvalue()
+    if hasattr(pdf_doc, 'read'):
+        data = pdf_doc.read()
+        pdf_doc.seek(0)
+        return data
+    with open(pdf_doc, 'rb') as f:
+        return f.read()
+
+# Extract the text of each page - returns (content hash, [page texts]).
+# A PDF we've seen before (same bytes) isn't parsed again.
+def get_pdf_pages(pdf_doc):
+    data = read_pdf_bytes(pdf_doc)
+    digest = hashlib.sha256(data).hexdigest()
+    pages = read_cache(PAGES_CACHE_DIR, digest)
+    if pages is None:
+        pdf_reader = PdfReader(io.BytesIO(data))
+        pages = [page.extract_text() for page in pdf_reader.pages]
+        write_cache(PAGES_CACHE_DIR, digest, pages)
+    return digest, pages
+
 # Extract Info rom PDF file
 def get_pdf_text(pdf_doc):
-    text=""
-    pdf_reader = PdfReader(pdf_doc)
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
+    _, pages = get_pdf_pages(pdf_doc)
+    return "".join(pages) # one join instead of growing a string page by page
 
 # Extract data from text
-def extracted_data(pages_data):
+def extraction_prompt(pages_data):
     template = """Extract all the following values : Invoice ID, DESCRIPTION, Issue Date, 
          UNIT PRICE, AMOUNT, Bill For, From and Terms from: {pages}
 
         Expected output: remove any dollar symbols {{'Invoice ID': '1001329','DESCRIPTION': 'UNIT PRICE','AMOUNT': '2','Date': '5/4/2023','AMOUNT': '1100.00', 'Bill For': 'james', 'From': 'excel company', 'Terms': 'pay this now'}}
         """
     prompt_template = PromptTemplate(input_variables=["pages"], template=template)
+    return prompt_template.format(pages=pages_data)
+
+def extracted_data(pages_data):
     llm = OpenAI(temperature=.7)
-    full_response=llm(prompt_template.format(pages=pages_data))
+    full_response=llm(extraction_prompt(pages_data))
     
     return full_response
 
+# same, but yields the response piece by piece as the LLM generates it
+def stream_extracted_data(pages_data):
+    llm = OpenAI(temperature=.7)
+    for chunk in llm.stream(extraction_prompt(pages_data)):
+        yield chunk
+
+# Several bills in one request: the instructions are sent once and the LLM
+# returns one object per document, tagged with its number
+def packed_extraction_prompt(pages_list):
+    documents = "\n".join(f"### Document {n}\n{pages}\n"
+                          for n, pages in enumerate(pages_list, 1))
+    template = """Extract all the following values : Invoice ID, DESCRIPTION, Issue Date, 
+         UNIT PRICE, AMOUNT, Bill For, From and Terms from each of the {count} documents below.
+
+        Expected output: a list with one object per document, in order, with the document
+        number under 'doc'. Remove any dollar symbols
+        [{{'doc': 1, 'Invoice ID': '1001329','DESCRIPTION': 'UNIT PRICE','AMOUNT': '2','Date': '5/4/2023','AMOUNT': '1100.00', 'Bill For': 'james', 'From': 'excel company', 'Terms': 'pay this now'}}]
+
+        {documents}
+        """
+    prompt_template = PromptTemplate(input_variables=["count", "documents"], template=template)
+    return prompt_template.format(count=len(pages_list), documents=documents)
+
+def extracted_data_packed(pages_list):
+    llm = OpenAI(temperature=.7)
+    return llm(packed_extraction_prompt(pages_list))
+
+# Spaces out LLM requests so we stay under the API rate limit, no matter how
+# many worker threads are waiting on it
+class RateLimiter:
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+# Column types of the extracted bills table
+BILL_COLUMNS = {'Invoice ID': 'string',
+                'DESCRIPTION': 'string',
+                'Issue Date': 'string',
+                'UNIT PRICE': 'string',
+                'AMOUNT': 'float64',
+                'Bill For': 'string',
+                'From': 'string',
+                'Terms': 'string'}
+
+# Collects extracted bills column by column and builds the DataFrame once at
+# the end, instead of a pd.concat() per bill (which copies the whole frame
+# every time). Keys the LLM returns on top of BILL_COLUMNS become extra string
+# columns - their values can be of any type (2 on one bill, '2 units' on the
+# next), which Parquet/Arrow can't put in one column.
+class BillAccumulator:
+    def __init__(self, columns=BILL_COLUMNS):
+        self.dtypes = dict(columns)
+        self.columns = {name: [] for name in columns}
+        self.rows = 0
+
+    def add(self, data_dict):
+        for name in data_dict:
+            if name not in self.columns:
+                self.columns[name] = [None] * self.rows
+        for name, values in self.columns.items():
+            values.append(data_dict.get(name))
+        self.rows += 1
+
+    def to_frame(self):
+        df = pd.DataFrame(self.columns)
+        for name, dtype in self.dtypes.items():
+            if dtype == 'string':
+                df[name] = df[name].astype('string')
+            else:
+                # amounts come back as '1,100.00' or '$1100' - strip before converting
+                cleaned = df[name].astype('string').str.replace(r'[$,\s]', '', regex=True)
+                df[name] = pd.to_numeric(cleaned, errors='coerce').astype(dtype)
+        for name in df.columns:
+            if name not in self.dtypes:
+                df[name] = df[name].astype('string')
+        return df
+
+# Parquet export, written one row group at a time (pip install pyarrow)
+def to_parquet_bytes(df, row_group_size=10_000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    buffer = io.BytesIO()
+    with pq.ParquetWriter(buffer, table.schema, compression='zstd') as writer:
+        for batch in table.to_batches(max_chunksize=row_group_size):
+            writer.write_batch(batch)
+    return buffer.getvalue()
+
+# Arrow IPC stream export, same idea (pip install pyarrow)
+def to_arrow_bytes(df, batch_size=10_000):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=batch_size):
+            writer.write_batch(batch)
+    return buffer.getvalue()
+
+# Rule-based extractor for bill layouts we've seen before (see templates.py)
+bill_templates = TemplateExtractor(BILL_COLUMNS)
+
+# First, LLM-free part of extracting a bill: a bill uploaded before (same
+# bytes) returns its earlier record, and a known template may fill it in.
+# Returns ('done', record) or ('llm', PendingBill) when the LLM is needed.
+class PendingBill:
+    def __init__(self, digest, raw_data, template_data, pages_data):
+        self.digest = digest
+        self.raw_data = raw_data
+        self.template_data = template_data
+        self.pages_data = pages_data
+
+def prepare_bill(pdf_doc, max_prompt_tokens=PROMPT_TOKEN_BUDGET):
+    print(pdf_doc)
+    digest, pages = get_pdf_pages(pdf_doc)
+    cached = read_cache(RECORDS_CACHE_DIR, digest)
+    if cached is not None:
+        print("Already extracted:", cached)
+        return 'done', cached
+    raw_data = "".join(pages)
+
+    template_data, missing = bill_templates.extract(raw_data)
+    template_data = {key: coerce_field(key, value, BILL_COLUMNS)
+                     for key, value in template_data.items()}
+    if template_data and not missing:
+        print("Extracted from a known template:", template_data)
+        write_cache(RECORDS_CACHE_DIR, digest, template_data)
+        return 'done', template_data
+
+    # only send the lines most likely to hold the fields, within the budget
+    pages_data, stats = prune_text(raw_data, max_prompt_tokens)
+    if stats['saved_tokens']:
+        print(f"Pruned prompt: {stats['kept_tokens']}/{stats['original_tokens']} tokens "
+              f"({stats['saved_tokens']} saved)")
+    return 'llm', PendingBill(digest, raw_data, template_data, pages_data)
+
+# single-bill LLM extraction, parsed while the response streams in: each field
+# is validated and handed to on_field as soon as it is complete
+def llm_extract(pages_data, rate_limiter=None, on_field=None):
+    if rate_limiter:
+        rate_limiter.wait()
+    parser = DictStreamParser(schema=BILL_COLUMNS, on_field=on_field)
+    for chunk in stream_extracted_data(pages_data):
+        parser.feed(chunk)
+        if parser.done:
+            break
+    print(parser.result if parser.result else "No match found.")
+    return parser.result
+
+# Last step: learn the layout for next time, fill in what the LLM left out
+# from the template (the LLM's own values always win), and remember the
+# record for re-uploads
+def finish_bill(bill, data_dict):
+    if not data_dict:
+        return bill.template_data or None
+    bill_templates.learn(bill.raw_data, data_dict)
+    for key, value in bill.template_data.items():
+        if data_dict.get(key) is None:
+            data_dict[key] = value
+    write_cache(RECORDS_CACHE_DIR, bill.digest, data_dict)
+    return data_dict
+
+# parse one pdf and extract its data - from the record cache or a known
+# template when we can, otherwise (or for fields the template can't fill)
+# with the llm. `on_field(key, value)` is called for each LLM field as soon as
+# it's known.
+def extract_bill(pdf_doc, rate_limiter=None, max_prompt_tokens=PROMPT_TOKEN_BUDGET,
+                 on_field=None):
+    status, result = prepare_bill(pdf_doc, max_prompt_tokens)
+    if status == 'done':
+        return result
+    return finish_bill(result, llm_extract(result.pages_data, rate_limiter, on_field))
+
+# Group pending bills into packs whose text fits in `pack_tokens` (one bill
+# too big for any pack still gets a pack of its own)
+def pack_bills(bills, pack_tokens, max_per_pack=10):
+    packs, current, used = [], [], 0
+    for bill in bills:
+        tokens = count_tokens(bill.pages_data)
+        if current and (used + tokens > pack_tokens or len(current) >= max_per_pack):
+            packs.append(current)
+            current, used = [], 0
+        current.append(bill)
+        used += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+# Extract a pack of bills with one request; any bill the response doesn't
+# cover properly (or every bill, if the request fails) is retried on its own,
+# without re-running the pack. Returns one data dict per bill, or the
+# exception for a bill that couldn't be extracted - it never raises, so bills
+# that did get extracted aren't paid for again.
+def extract_pack(pack, rate_limiter=None):
+    by_doc = {}
+    if len(pack) > 1:
+        try:
+            if rate_limiter:
+                rate_limiter.wait()
+            items = parse_dict_list(extracted_data_packed([bill.pages_data for bill in pack]),
+                                    schema=BILL_COLUMNS)
+        except Exception as e:
+            print(f"Packed request failed ({e}), retrying its bills one by one")
+            items = []
+        for item in items:
+            doc = item.pop('doc', None)
+            if isinstance(doc, (int, float)):
+                by_doc[int(doc)] = item
+        print(f"Packed request: {len(by_doc)}/{len(pack)} bills extracted")
+
+    results = []
+    for n, bill in enumerate(pack, 1):
+        try:
+            data_dict = by_doc.get(n)
+            if not data_dict:
+                data_dict = llm_extract(bill.pages_data, rate_limiter)
+            results.append(finish_bill(bill, data_dict))
+        except Exception as e:
+            print(f"Failed to extract bill {bill.digest[:12]}: {e}")
+            results.append(e)
+    return results
+
 # create documents from the uploaded pdfs
-def create_docs(user_pdf_list):
-    df = pd.DataFrame({'Invoice ID': pd.Series(dtype='int'),
-                   'DESCRIPTION': pd.Series(dtype='str'),
-                   'Issue Date': pd.Series(dtype='str'),
-	              'UNIT PRICE': pd.Series(dtype='str'),
-                   'AMOUNT': pd.Series(dtype='int'),
-                   'Bill For': pd.Series(dtype='str'),
-	                'From': pd.Series(dtype='str'),
-                   'Terms': pd.Series(dtype='str')
-                    
-                    })
-
-    for filename in user_pdf_list:
-        
-        print(filename)
-        raw_data=get_pdf_text(filename)
-        #print(raw_data)
-        #print("extracted raw data")
-
-        llm_extracted_data=extracted_data(raw_data)
-        #print("llm extracted data")
-        #Adding items to our list - Adding data & its metadata
-
-        pattern = r'{(.+)}' # capture one or more of any character, except newline
-        match = re.search(pattern, llm_extracted_data, re.DOTALL)
-
-        if match:
-            extracted_text = match.group(1)
-            # Converting the extracted text to a dictionary
-            data_dict = eval('{' + extracted_text + '}')
-            print(data_dict)
+# Bills are processed `max_workers` at a time (PDF parsing of one file overlaps
+# with the LLM calls in flight for others); `requests_per_minute` caps the LLM
+# request rate and `max_prompt_tokens` the bill text sent per request. Rows
+# come back in upload order, and a bill that fails is reported and skipped
+# instead of stopping the whole upload.
+# With `pack_tokens` set, bills that need the LLM are sent several per request
+# (up to that many tokens of bill text) instead of one request each.
+# `on_field(pdf_doc, key, value)` gets each field of a single-bill request as
+# soon as the LLM has written it (packed responses are parsed as a whole).
+def create_docs(user_pdf_list, max_workers=4, requests_per_minute=None,
+                max_prompt_tokens=PROMPT_TOKEN_BUDGET, pack_tokens=None, on_field=None):
+    bills = BillAccumulator()
+
+    rate_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+
+    def safe_extract(pdf_doc):
+        field_callback = None
+        if on_field:
+            field_callback = lambda key, value: on_field(pdf_doc, key, value)
+        try:
+            return extract_bill(pdf_doc, rate_limiter, max_prompt_tokens, field_callback)
+        except Exception as e:
+            print(f"Failed to extract {pdf_doc}: {e}")
+            return None
+
+    def safe_prepare(pdf_doc):
+        try:
+            return prepare_bill(pdf_doc, max_prompt_tokens)
+        except Exception as e:
+            print(f"Failed to extract {pdf_doc}: {e}")
+            return 'done', None
+
+    def safe_extract_pack(pack):
+        return [None if isinstance(result, Exception) else result
+                for result in extract_pack(pack, rate_limiter)]
+
+    # pool.map keeps the results in the same order as the uploaded files
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if pack_tokens:
+            prepared = list(pool.map(safe_prepare, user_pdf_list))
+            results = [result if status == 'done' else None for status, result in prepared]
+            pending = [(n, result) for n, (status, result) in enumerate(prepared)
+                       if status == 'llm']
+            order = {id(bill): n for n, bill in pending}
+            packs = pack_bills([bill for _, bill in pending], pack_tokens)
+            for pack, pack_results in zip(packs, pool.map(safe_extract_pack, packs)):
+                for bill, data_dict in zip(pack, pack_results):
+                    results[order[id(bill)]] = data_dict
         else:
-            print("No match found.")
+            results = pool.map(safe_extract, user_pdf_list)
 
-     
-        # df=df.append([data_dict], ignore_index=True) #this won't work!!
-        df = pd.concat([df, pd.DataFrame([data_dict])], ignore_index=True)
-    
-        # df = pd.concat(df, pd.DataFrame([eval('{' +item+'}')]), ignore_index=True )
+        for data_dict in results:
+            if data_dict is not None:
+                bills.add(data_dict)
 
-        print("********************DONE***************")
-        #df=df.append(save_to_dataframe(llm_extracted_data), ignore_index=True)
+    print("********************DONE***************")
 
+    df = bills.to_frame()
     df.head()
-    return df
\ No newline at end of file
+    return df
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import (PROMPT_TOKEN_BUDGET, BillAccumulator, RateLimiter, extract_bill,
+                     extract_pack, pack_bills, prepare_bill)
+
+JOBS_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite')
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'uploads')
+
+
+# Extraction jobs run on a local worker pool, outside the Streamlit script
+# thread, and every file's progress is kept in a SQLite job table. A browser
+# refresh or a rerun just reads the table again; files still pending when the
+# process stopped are picked up again when the queue starts, and a file that
+# was already extracted (same bytes, any job) is never processed twice - one
+# that is still being extracted for another job (a second click on Extract)
+# waits for that result instead of being sent to the LLM again.
+# The prompt budget and pack size are kept per job, the request rate limit is
+# shared by all of them.
+#
+#   queue = JobQueue()
+#   job_id = queue.submit(pdf_files, max_prompt_tokens=1500, pack_tokens=3000)
+#   queue.status(job_id)    # per-file progress, with the fields streamed in so far
+#   queue.to_frame(job_id)  # the bills extracted so far
+class JobQueue:
+
+    def __init__(self, db_path=JOBS_DB, max_workers=4, requests_per_minute=None,
+                 max_prompt_tokens=PROMPT_TOKEN_BUDGET, pack_tokens=None):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.pack_tokens = pack_tokens
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                max_prompt_tokens INTEGER,
+                pack_tokens INTEGER);
+            CREATE TABLE IF NOT EXISTS files (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                status TEXT NOT NULL,  -- pending, running, waiting (on the same
+                                       -- file in another job), done or failed
+                result TEXT,
+                error TEXT,
+                partial TEXT,  -- fields streamed in so far, while running
+                PRIMARY KEY (job_id, idx));
+            CREATE INDEX IF NOT EXISTS files_digest ON files (digest, status);
+        """)
+        # job tables from before these columns
+        self._add_column('files', 'partial', 'TEXT')
+        self._add_column('jobs', 'max_prompt_tokens', 'INTEGER')
+        self._add_column('jobs', 'pack_tokens', 'INTEGER')
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.requests_per_minute = None
+        self.rate_limiter = None
+        self.set_requests_per_minute(requests_per_minute)
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        self.resume()
+
+    def _add_column(self, table, column, column_type):
+        columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+            self.conn.commit()
+
+    # shared by every job; None (or 0) for no limit
+    def set_requests_per_minute(self, requests_per_minute):
+        if requests_per_minute != self.requests_per_minute:
+            self.requests_per_minute = requests_per_minute
+            self.rate_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            self.conn.commit()
+        return rows
+
+    def _upload_path(self, digest):
+        return os.path.join(UPLOADS_DIR, digest + '.pdf')
+
+    def submit(self, pdf_files, max_prompt_tokens=None, pack_tokens=None):
+        job_id = uuid.uuid4().hex
+        self._execute('INSERT INTO jobs VALUES (?, ?, ?, ?)',
+                      (job_id, time.time(), max_prompt_tokens or self.max_prompt_tokens,
+                       self.pack_tokens if pack_tokens is None else pack_tokens or None))
+        queued = []
+        for idx, pdf_file in enumerate(pdf_files):
+            data = pdf_file.getvalue()
+            digest = hashlib.sha256(data).hexdigest()
+            path = self._upload_path(digest)
+            if not os.path.exists(path):  # a worker may be reading an earlier copy
+                tmp_path = f'{path}.{job_id}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+
+            # checked and inserted under one lock, so a file can't finish in between
+            with self.lock:
+                done = self.conn.execute("SELECT result FROM files WHERE digest = ? "
+                                         "AND status = 'done' LIMIT 1", (digest,)).fetchone()
+                in_flight = self.conn.execute("SELECT 1 FROM files WHERE digest = ? "
+                                              "AND status IN ('pending', 'running') LIMIT 1",
+                                              (digest,)).fetchone()
+                status = 'done' if done else 'waiting' if in_flight else 'pending'
+                self.conn.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, NULL, NULL)",
+                                  (job_id, idx, pdf_file.name, digest, status,
+                                   done[0] if done else None))
+                self.conn.commit()
+            if status != 'pending':
+                continue
+            queued.append((idx, digest))
+        self._dispatch(job_id, queued)
+        return job_id
+
+    # requeue files that were pending (or mid-way) when the last process stopped
+    def resume(self):
+        # a file waiting on one that is no longer queued gets queued itself
+        self._execute("UPDATE files SET status = 'pending' WHERE rowid IN ("
+                      " SELECT MIN(rowid) FROM files AS w WHERE status = 'waiting' AND NOT EXISTS ("
+                      "  SELECT 1 FROM files WHERE digest = w.digest"
+                      "  AND status IN ('pending', 'running'))"
+                      " GROUP BY digest)")
+        rows = self._execute("SELECT job_id, idx, digest FROM files "
+                             "WHERE status IN ('pending', 'running') ORDER BY job_id, idx")
+        by_job = {}
+        for job_id, idx, digest in rows:
+            by_job.setdefault(job_id, []).append((idx, digest))
+        for job_id, items in by_job.items():
+            self._dispatch(job_id, items)
+
+    # With `pack_tokens` set, the files of a job go out several per LLM request
+    # (see pack_bills in helpers.py); otherwise - or for a single file - each
+    # file is its own request, with its fields streamed into the job table.
+    def _dispatch(self, job_id, items):
+        max_prompt_tokens, pack_tokens = self._settings(job_id)
+        if pack_tokens and len(items) > 1:
+            self.pool.submit(self._run_packed, job_id, items, max_prompt_tokens, pack_tokens)
+        else:
+            for idx, digest in items:
+                self.pool.submit(self._run, job_id, idx, digest, max_prompt_tokens)
+
+    def _settings(self, job_id):
+        rows = self._execute('SELECT max_prompt_tokens, pack_tokens FROM jobs WHERE id = ?',
+                             (job_id,))
+        max_prompt_tokens, pack_tokens = rows[0] if rows else (None, None)
+        return max_prompt_tokens or self.max_prompt_tokens, pack_tokens
+
+    def _set_running(self, job_id, idx):
+        self._execute("UPDATE files SET status = 'running' WHERE job_id = ? AND idx = ?",
+                      (job_id, idx))
+
+    # record the outcome for the file, and for the same file in any job waiting on it
+    def _finish(self, job_id, idx, digest, data_dict=None, error=None):
+        if error is None and data_dict is None:
+            error = ValueError("no data could be extracted")
+        where = "WHERE (job_id = ? AND idx = ?) OR (digest = ? AND status = 'waiting')"
+        if error is not None:
+            print(f"Failed to extract {digest[:12]}: {error}")
+            self._execute("UPDATE files SET status = 'failed', error = ? " + where,
+                          (str(error), job_id, idx, digest))
+            return
+        self._execute("UPDATE files SET status = 'done', result = ? " + where,
+                      (json.dumps(data_dict, default=str), job_id, idx, digest))
+
+    def _run(self, job_id, idx, digest, max_prompt_tokens):
+        self._set_running(job_id, idx)
+        partial = {}
+
+        # each field is shown as soon as the LLM has written it out
+        def on_field(key, value):
+            partial[key] = value
+            self._execute('UPDATE files SET partial = ? WHERE job_id = ? AND idx = ?',
+                          (json.dumps(partial, default=str), job_id, idx))
+
+        try:
+            data_dict = extract_bill(self._upload_path(digest), self.rate_limiter,
+                                     max_prompt_tokens, on_field)
+        except Exception as e:
+            self._finish(job_id, idx, digest, error=e)
+            return
+        self._finish(job_id, idx, digest, data_dict)
+
+    # parse every file of the job and check the caches/templates first; the
+    # bills still needing the LLM are packed and each pack is queued on its own
+    def _run_packed(self, job_id, items, max_prompt_tokens, pack_tokens):
+        pending = []
+        for idx, digest in items:
+            self._set_running(job_id, idx)
+            try:
+                status, result = prepare_bill(self._upload_path(digest), max_prompt_tokens)
+            except Exception as e:
+                self._finish(job_id, idx, digest, error=e)
+                continue
+            if status == 'done':
+                self._finish(job_id, idx, digest, result)
+            else:
+                pending.append(((idx, digest), result))
+
+        where = {id(bill): item for item, bill in pending}
+        for pack in pack_bills([bill for _, bill in pending], pack_tokens):
+            self.pool.submit(self._run_pack, job_id, [(where[id(bill)], bill) for bill in pack])
+
+    def _run_pack(self, job_id, pack_items):
+        pack = [bill for _, bill in pack_items]
+        results = extract_pack(pack, self.rate_limiter)
+        for ((idx, digest), _), result in zip(pack_items, results):
+            if isinstance(result, Exception):
+                self._finish(job_id, idx, digest, error=result)
+            else:
+                self._finish(job_id, idx, digest, result)
+
+    def status(self, job_id):
+        rows = self._execute('SELECT name, status, error, partial FROM files WHERE job_id = ? '
+                             'ORDER BY idx', (job_id,))
+        return [{'name': name, 'status': status, 'error': error,
+                 'partial': json.loads(partial) if partial else {}}
+                for name, status, error, partial in rows]
+
+    def to_frame(self, job_id):
+        bills = BillAccumulator()
+        rows = self._execute("SELECT result FROM files WHERE job_id = ? AND status = 'done' "
+                             "ORDER BY idx", (job_id,))
+        for (result,) in rows:
+            bills.add(json.loads(result))
+        return bills.to_frame()
@@ -0,0 +1,69 @@
+import re
+import tiktoken
+
+# OpenAI() in helpers.py uses gpt-3.5-turbo-instruct
+ENCODING = tiktoken.encoding_for_model("gpt-3.5-turbo-instruct")
+
+# words that tend to sit next to the values we extract
+FIELD_KEYWORDS = {
+    'Invoice ID': ['invoice', 'invoice id', 'invoice #', 'invoice no', 'bill no', 'account'],
+    'DESCRIPTION': ['description', 'item', 'service', 'details'],
+    'Issue Date': ['date', 'issued', 'issue date'],
+    'UNIT PRICE': ['unit price', 'rate', 'price', 'qty', 'quantity'],
+    'AMOUNT': ['amount', 'total', 'balance', 'subtotal', 'due'],
+    'Bill For': ['bill for', 'bill to', 'billed to', 'customer', 'tenant'],
+    'From': ['from', 'company', 'landlord', 'provider'],
+    'Terms': ['terms', 'payment', 'pay by', 'due date', 'late fee'],
+}
+
+_VALUE_PATTERNS = [
+    re.compile(r'\$\s?\d[\d,]*(?:\.\d\d)?'),         # money
+    re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'),  # dates
+    re.compile(r'\b[A-Z]*\d{4,}[A-Z]*\b'),           # IDs / account numbers
+]
+
+
+def count_tokens(text):
+    return len(ENCODING.encode(text))
+
+
+# how likely a line is to hold (or label) one of the fields we're after
+def score_line(line):
+    lowered = line.lower()
+    score = 0.0
+    for keywords in FIELD_KEYWORDS.values():
+        if any(keyword in lowered for keyword in keywords):
+            score += 1.0
+    for pattern in _VALUE_PATTERNS:
+        score += 0.5 * len(pattern.findall(line))
+    return score
+
+
+# Keep only the best-scoring lines of a bill within `max_tokens`, in their
+# original order. A line also gets part of the score of the line above it, as
+# values often sit under their label. Text that already fits is left alone.
+# Returns (pruned text, {'original_tokens', 'kept_tokens', 'saved_tokens'}).
+def prune_text(text, max_tokens=1500):
+    original_tokens = count_tokens(text)
+    if original_tokens <= max_tokens:
+        return text, {'original_tokens': original_tokens, 'kept_tokens': original_tokens,
+                      'saved_tokens': 0}
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    own = [score_line(line) for line in lines]
+    scores = [own[n] + (0.5 * own[n - 1] if n else 0.0) for n in range(len(lines))]
+
+    kept, used = set(), 0
+    for n in sorted(range(len(lines)), key=lambda n: (-scores[n], n)):
+        if scores[n] <= 0:
+            break
+        tokens = count_tokens(lines[n]) + 1  # + the newline
+        if used + tokens > max_tokens:
+            continue
+        kept.add(n)
+        used += tokens
+
+    pruned = "\n".join(lines[n] for n in sorted(kept))
+    kept_tokens = count_tokens(pruned)
+    return pruned, {'original_tokens': original_tokens, 'kept_tokens': kept_tokens,
+                    'saved_tokens': original_tokens - kept_tokens}
@@ -0,0 +1,219 @@
+import ast
+import json
+import re
+
+
+class _Incomplete(Exception):
+    pass
+
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '/': '/',
+            '\\': '\\', "'": "'", '"': '"'}
+_LITERALS = {'true': True, 'True': True, 'false': False, 'False': False,
+             'null': None, 'None': None}
+
+
+# Make an extracted value fit its column: 'string' columns get stripped text,
+# numeric ones a float ('$1,100.00' -> 1100.0, None when it isn't a number).
+# Keys that aren't in the schema are passed through untouched.
+def coerce_field(key, value, schema):
+    dtype = schema.get(key)
+    if dtype is None or value is None:
+        return value
+    if dtype == 'string':
+        return str(value).strip()
+    try:
+        return float(re.sub(r'[$,\s]', '', str(value)))
+    except ValueError:
+        print(f"Invalid value for {key}: {value!r}")
+        return None
+
+
+# Incremental parser for the dictionary the LLM writes out - JSON or a Python
+# dict literal ({'Invoice ID': '1001329', ...}), possibly with text around it.
+# Feed it the response as it streams in; each field is returned (and passed to
+# `on_field`) as soon as its value is complete, long before the closing brace.
+# Nothing is ever eval()'d: strings, numbers and literals are parsed by hand
+# and nested containers go through ast.literal_eval.
+#
+#   parser = DictStreamParser(schema=BILL_COLUMNS)
+#   for chunk in llm.stream(prompt):
+#       for key, value in parser.feed(chunk):
+#           ...
+#   data_dict = parser.result
+class DictStreamParser:
+
+    def __init__(self, schema=None, on_field=None):
+        self.schema = schema or {}
+        self.on_field = on_field
+        self.buffer = ''
+        self.pos = 0
+        self.started = False
+        self.done = False
+        self.result = {}
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        fields = []
+        while not self.done:
+            try:
+                item = self._next_item()
+            except _Incomplete:
+                break
+            if item is None:
+                break
+            key, value = item
+            value = coerce_field(key, value, self.schema)
+            self.result[key] = value
+            fields.append((key, value))
+            if self.on_field:
+                self.on_field(key, value)
+        return fields
+
+    # parse a whole response at once
+    def parse(self, text):
+        self.feed(text)
+        return self.result
+
+    def _char(self, i):
+        if i >= len(self.buffer):
+            raise _Incomplete()
+        return self.buffer[i]
+
+    def _skip_ws(self, i):
+        while i < len(self.buffer) and self.buffer[i].isspace():
+            i += 1
+        return i
+
+    def _string(self, i):
+        quote, i, out = self._char(i), i + 1, []
+        while True:
+            c = self._char(i)
+            if c == '\\':
+                e = self._char(i + 1)
+                if e == 'u':
+                    code = self.buffer[i + 2:i + 6]
+                    if len(code) < 4:
+                        raise _Incomplete()
+                    out.append(chr(int(code, 16)))
+                    i += 6
+                else:
+                    out.append(_ESCAPES.get(e, e))
+                    i += 2
+            elif c == quote:
+                return ''.join(out), i + 1
+            else:
+                out.append(c)
+                i += 1
+
+    def _container(self, i):
+        # capture the balanced {...} / [...] (minding strings) and parse it safely
+        start, depth = i, 0
+        while True:
+            c = self._char(i)
+            if c in '"\'':
+                _, i = self._string(i)
+                continue
+            if c in '{[':
+                depth += 1
+            elif c in '}]':
+                depth -= 1
+                if depth == 0:
+                    raw = self.buffer[start:i + 1]
+                    try:
+                        return json.loads(raw), i + 1
+                    except ValueError:
+                        return ast.literal_eval(raw), i + 1
+            i += 1
+
+    def _scalar(self, i):
+        # a bare number/literal ends at the next ',' or '}' - so it isn't
+        # complete until that delimiter has arrived
+        end = i
+        while True:
+            c = self._char(end)
+            if c in '}\n':
+                break
+            if c == ',':
+                # 1,100.00 (or $1,100.00, -$1,100.00) written out without
+                # quotes: the comma is part of the number, not the end of the item
+                if (re.fullmatch(r'-?\$?-?\d[\d,]*', self.buffer[i:end].strip())
+                        and self._char(end + 1).isdigit()):
+                    end += 1
+                    continue
+                break
+            end += 1
+        token = self.buffer[i:end].strip()
+        if ',' in token:
+            # ambiguous, so don't guess a number - the field is left empty
+            print(f"Invalid unquoted number: {token!r}")
+            return None, end
+        if token in _LITERALS:
+            return _LITERALS[token], end
+        try:
+            return (int(token) if re.fullmatch(r'-?\d+', token) else float(token)), end
+        except ValueError:
+            return token, end
+
+    def _value(self, i):
+        c = self._char(i)
+        if c in '"\'':
+            return self._string(i)
+        if c in '{[':
+            return self._container(i)
+        return self._scalar(i)
+
+    def _next_item(self):
+        if not self.started:
+            start = self.buffer.find('{', self.pos)
+            if start < 0:
+                self.pos = len(self.buffer)
+                return None
+            self.started = True
+            self.pos = start + 1
+
+        i = self._skip_ws(self.pos)
+        c = self._char(i)
+        if c == '}':
+            self.done = True
+            self.pos = i + 1
+            return None
+        if c == ',':
+            i = self._skip_ws(i + 1)
+            c = self._char(i)
+            if c == '}':  # trailing comma
+                self.done = True
+                self.pos = i + 1
+                return None
+
+        if c in '"\'':
+            key, i = self._string(i)
+        else:
+            end = self.buffer.find(':', i)
+            if end < 0:
+                raise _Incomplete()
+            key, i = self.buffer[i:end].strip(), end
+        i = self._skip_ws(i)
+        if self._char(i) != ':':
+            raise ValueError(f"Expected ':' after {key!r} in LLM output")
+        value, i = self._value(self._skip_ws(i + 1))
+        self.pos = i
+        return key, value
+
+
+# Parse a list of dictionaries ([{...}, {...}]) one object at a time with
+# DictStreamParser. A truncated or broken tail is dropped, so whatever objects
+# did come through complete are still returned.
+def parse_dict_list(text, schema=None):
+    items, pos = [], 0
+    while True:
+        parser = DictStreamParser(schema=schema)
+        try:
+            parser.feed(text[pos:])
+        except (ValueError, SyntaxError):
+            break
+        if not parser.done:
+            break
+        items.append(parser.result)
+        pos += parser.pos
+    return items
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from prune import FIELD_KEYWORDS
+
+# Learned bill layouts, kept next to this file so they survive restarts
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bill_templates.json')
+
+
+# '$1,100.00' -> 1100.0 (None if it isn't a number)
+def _number(value):
+    cleaned = re.sub(r'[$,\s]', '', value)
+    if not re.fullmatch(r'\d+(?:\.\d+)?', cleaned):
+        return None
+    return float(cleaned)
+
+
+def _same_value(found, expected):
+    found, expected = found.strip(), expected.strip()
+    if found == expected:
+        return True
+    return _number(expected) is not None and _number(found) == _number(expected)
+
+
+# where `value` sits in `line` - numbers may be written with $ and thousands separators
+def _find_value(line, value):
+    start = line.find(value)
+    if start >= 0:
+        return start, start + len(value)
+    if _number(value) is not None:
+        for match in re.finditer(r'\$?\d[\d,]*(?:\.\d+)?', line):
+            if _number(match.group()) == _number(value):
+                return match.span()
+    return None
+
+
+# label text to regex: numbers (dates, amounts, page numbers...) vary between bills
+def _label_regex(label):
+    parts = re.split(r'\d(?:[\d,./-]*\d)?', label)
+    return r'[\d,./-]+'.join(re.escape(part) for part in parts)
+
+
+# Every way to find `value` in `text` again: the text in front of it on the
+# same line ("Invoice ID:"), or the line above it when it sits on its own line.
+# Labels made of another field's value ("Consulting $1,100.00") change from
+# bill to bill, so they're not used. Yields (line number, label text, label
+# regex, field regex) for each line the value is on.
+def field_candidates(text, value, other_values=()):
+    lines = text.splitlines()
+    for n, line in enumerate(lines):
+        span = _find_value(line, value)
+        if not span:
+            continue
+        prefix, suffix = line[:span[0]].strip(), line[span[1]:].strip()
+        tail = (r'\s*' + _label_regex(suffix) if suffix else '') + r'[ \t]*$'
+        if prefix:
+            label_text = prefix
+            pattern = r'^[ \t]*' + _label_regex(prefix) + r'[ \t]*(.+?)' + tail
+        else:
+            previous = [l.strip() for l in lines[:n] if l.strip()]
+            if not previous:
+                continue
+            label_text = previous[-1]
+            pattern = r'^[ \t]*' + _label_regex(label_text) + r'[ \t]*\n[ \t]*(.+?)' + tail
+        if any(other and other in label_text for other in other_values):
+            continue
+        match = re.search(pattern, text, re.MULTILINE)
+        if match and _same_value(match.group(1), value):
+            yield n, label_text, _label_regex(label_text), pattern
+
+
+# does the label read like a label for `field` ("Amount Due:" for AMOUNT)?
+def _label_fits(field, label_text):
+    lowered = label_text.lower()
+    return any(keyword in lowered for keyword in FIELD_KEYWORDS.get(field, ()))
+
+
+# Pick one line per field. Two fields often have the same value (UNIT PRICE and
+# AMOUNT on a quantity-1 bill), so a line only ever serves one field, and lines
+# whose label reads like the field's own label are handed out first.
+# Returns {field: (label regex, field regex)}.
+def learn_fields(text, values):
+    candidates = []
+    for field, value in values.items():
+        others = [v for f, v in values.items() if f != field and v != value]
+        for n, label_text, label, pattern in field_candidates(text, value, others):
+            candidates.append((not _label_fits(field, label_text), n, field, label, pattern))
+    learned, used_lines = {}, set()
+    for _, n, field, label, pattern in sorted(candidates):
+        if field in learned or n in used_lines:
+            continue
+        learned[field] = (label, pattern)
+        used_lines.add(n)
+    return learned
+
+
+# Rule-based fast path in front of the LLM. Each template is a set of anchor
+# labels plus one regex per field, learned from earlier LLM extractions of the
+# same layout (see learn()). A bill whose text has all of a template's anchors
+# is filled in locally; the LLM is only needed for unknown layouts, for fields
+# whose pattern didn't match, and for fields the LLM found in earlier bills of
+# the layout that we couldn't learn a pattern for ('llm_only').
+# A pattern is only used once a second bill of the layout has confirmed it
+# ('candidates' holds the ones seen on a single bill so far), and one that
+# stops agreeing with the LLM is dropped again.
+class TemplateExtractor:
+
+    def __init__(self, fields, path=TEMPLATES_PATH, min_fields=3, confirmations=2):
+        self.fields = list(fields)
+        self.path = path
+        self.min_fields = min_fields
+        self.confirmations = confirmations
+        self.lock = threading.Lock()
+        self.templates = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.templates = json.load(f)
+            for template in self.templates:
+                # templates from before patterns needed confirming: one more bill confirms them
+                if 'candidates' not in template:
+                    template['candidates'] = {field: {pattern: ['unconfirmed']}
+                                              for field, pattern in template['patterns'].items()}
+                    template['patterns'] = {}
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.templates, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _matches(self, template, text):
+        return all(re.search(anchor, text, re.MULTILINE) for anchor in template['anchors'])
+
+    # Returns (values found, fields still missing); ({}, all fields) when no
+    # known template fits the text.
+    def extract(self, text):
+        # learn() changes the templates from other threads - match against a
+        # copy of them taken under the lock
+        with self.lock:
+            templates = sorted(({'anchors': list(t['anchors']), 'patterns': dict(t['patterns']),
+                                 'llm_only': list(t['llm_only']),
+                                 'candidates': list(t['candidates'])}
+                                for t in self.templates if t['patterns']),
+                               key=lambda t: -len(t['patterns']))
+        for template in templates:
+            if not self._matches(template, text):
+                continue
+            values = {}
+            for field, pattern in template['patterns'].items():
+                match = re.search(pattern, text, re.MULTILINE)
+                if match:
+                    value = match.group(1).strip()
+                    # same as the LLM prompt asks for: no dollar symbols
+                    values[field] = value[1:] if re.fullmatch(r'\$[\d,.]+', value) else value
+            missing = [field for field in template['patterns'] if field not in values]
+            missing += [field for field in template['llm_only'] + template['candidates']
+                        if field not in values]
+            return values, missing
+        return {}, list(self.fields)
+
+    # Learn (or extend) a template from a bill and the values the LLM found in it
+    def learn(self, text, data_dict):
+        values = {field: str(data_dict[field]).strip() for field in self.fields
+                  if data_dict.get(field) is not None and str(data_dict[field]).strip()}
+        learned = learn_fields(text, values)
+        if len(learned) < self.min_fields:
+            return
+        anchors = sorted({label for label, _ in learned.values()})
+        bill_id = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+        with self.lock:
+            for template in self.templates:
+                if sorted(template['anchors']) == anchors:
+                    break
+            else:
+                template = {'anchors': anchors, 'patterns': {}, 'candidates': {},
+                            'llm_only': []}
+                self.templates.append(template)
+
+            # a confirmed pattern that gives something else than the LLM did is wrong
+            for field, pattern in list(template['patterns'].items()):
+                if field not in values:
+                    continue
+                match = re.search(pattern, text, re.MULTILINE)
+                if not match or not _same_value(match.group(1), values[field]):
+                    del template['patterns'][field]
+
+            for field, (_, pattern) in learned.items():
+                if template['patterns'].get(field) == pattern:
+                    continue
+                seen_on = template['candidates'].setdefault(field, {}).setdefault(pattern, [])
+                if bill_id not in seen_on:
+                    seen_on.append(bill_id)
+                if len(seen_on) >= self.confirmations:
+                    template['patterns'][field] = pattern
+                    del template['candidates'][field]
+
+            template['llm_only'] = sorted((set(template['llm_only']) | set(values))
+                                          - set(learned) - set(template['patterns']))
+            self._save()
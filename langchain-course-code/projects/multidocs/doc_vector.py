@@ -8,6 +8,13 @@ from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import Chroma
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.chains import RetrievalQA
+from ingest import iter_chunks, upsert_in_batches
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # for rag_helpers/
+from rag_helpers.embedding_cache import CachedEmbeddings
+from rag_helpers.dedup import NearDuplicateFilter
+from rag_helpers.answer_cache import CachedRetrievalQA
+from rag_helpers.hybrid_retriever import BM25Index, HybridRetriever
 
 
 
@@ -24,31 +31,39 @@ llm = ChatOpenAI(temperature=0.0, model=llm_model)
 #### === packages to install ====
 # pip install langchain pypdf openai chromadb tiktoken docx2txt
 
-# load the pdf file
+# load the pdf file (lazily - pages are parsed as they are needed)
 pf_loader = PyPDFLoader('./docs/RachelGreenCV.pdf')
-documents = pf_loader.load()
 
 # Now we split the data into chunks
 text_splitter = CharacterTextSplitter(
     chunk_size=1000,
     chunk_overlap=200
 )
-docs = text_splitter.split_documents(documents)
 
-# create our vector db chromadb
-vectordb = Chroma.from_documents(
-    documents=docs,
-    embedding=OpenAIEmbeddings(),
+# create our vector db chromadb and stream the pages through the splitter
+# into it in batches, instead of splitting and embedding everything at once.
+# Near-duplicate chunks are dropped before they get embedded.
+vectordb = Chroma(
+    embedding_function=CachedEmbeddings(OpenAIEmbeddings()),
     persist_directory='./data'
 )
+chunks = NearDuplicateFilter().filter(iter_chunks(pf_loader.lazy_load(), text_splitter))
+upsert_in_batches(vectordb, chunks)
 vectordb.persist()
 
+# keep a BM25 (keyword) index of the same chunks next to the vector db, so exact
+# tokens like IDs or numbers are found too
+bm25_index = BM25Index.from_chroma(vectordb)
+bm25_index.save('./data/bm25.json.gz')
+
 # Use RetrievalQA chain to get info from the vectorstore
-qa_chain = RetrievalQA.from_chain_type(
+# (wrapped in an answer cache - repeated questions over the same chunks skip the LLM)
+qa_chain = CachedRetrievalQA(RetrievalQA.from_chain_type(
     llm,
-    retriever=vectordb.as_retriever(search_kwargs={'k':3}),
+    retriever=HybridRetriever(vector_retriever=vectordb.as_retriever(search_kwargs={'k':3}),
+                              bm25_index=bm25_index, k=3),
     return_source_documents=True
-)
+))
 
 result = qa_chain("whe did Rachel graduate?")
 #results = qa_chain({'query': 'Who is the CV about?'}) # the other way of doing the same thing
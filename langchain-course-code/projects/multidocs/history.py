@@ -0,0 +1,58 @@
+from functools import lru_cache
+import tiktoken
+
+ENCODING = tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+# token counts are memoized so a message is only ever encoded once
+@lru_cache(maxsize=4096)
+def count_tokens(text):
+    return len(ENCODING.encode(text))
+
+
+# the first `max_tokens` tokens of text
+def truncate(text, max_tokens):
+    tokens = ENCODING.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return ENCODING.decode(tokens[:max(max_tokens, 0)])
+
+
+# Chat history for one Streamlit session, bounded by a token budget.
+# window() returns the newest (question, answer) turns that fit in `max_tokens`,
+# so the condense-question prompt stays the same size however long the chat gets.
+# Turns that can no longer fit are dropped - except the newest one, which is
+# always kept: if it is too long on its own, its answer (and, if need be, its
+# question) is cut down to fit instead.
+class ChatHistory:
+
+    def __init__(self, max_tokens=1000):
+        self.max_tokens = max_tokens
+        self.turns = []
+
+    def turn_tokens(self, turn):
+        question, answer = turn
+        return count_tokens(question) + count_tokens(answer)
+
+    def add(self, question, answer):
+        self.turns.append((question, answer))
+        self.turns = self.window()
+
+    def fit_turn(self, turn):
+        question, answer = turn
+        question = truncate(question, self.max_tokens)
+        return question, truncate(answer, self.max_tokens - count_tokens(question))
+
+    def window(self):
+        if not self.turns:
+            return []
+        if self.turn_tokens(self.turns[-1]) > self.max_tokens:
+            return [self.fit_turn(self.turns[-1])]
+        kept, used = [], 0
+        for turn in reversed(self.turns):
+            used += self.turn_tokens(turn)
+            if used > self.max_tokens:
+                break
+            kept.append(turn)
+        kept.reverse()
+        return kept
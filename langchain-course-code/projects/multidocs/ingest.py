@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from langchain.docstore.document import Document
+
+from load_docs import get_loader, iter_file_pages, iter_files_parallel
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # for rag_helpers/
+from rag_helpers.dedup import NearDuplicateFilter
+
+# The manifest lives next to the persisted Chroma collection and records,
+# per file in docs/: size, mtime, content hash and the chunk IDs we upserted.
+# Beside it, manifest.signatures.json has the MinHash signature of every stored
+# chunk, so the next run can tell a new file's chunks are near-duplicates of
+# existing ones.
+MANIFEST_PATH = './data/manifest.json'
+
+
+def file_digest(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def signatures_path(manifest_path=MANIFEST_PATH):
+    return os.path.splitext(manifest_path)[0] + '.signatures.json'
+
+
+# chunk ID -> MinHash signature; 64 numbers per chunk, so this is the big file
+# and it is written compactly, once per sync
+def load_signatures(manifest_path=MANIFEST_PATH):
+    path = signatures_path(manifest_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_signatures(signatures, manifest_path=MANIFEST_PATH):
+    path = signatures_path(manifest_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(signatures, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+# list the supported files in the docs folder (sorted, so runs are deterministic)
+def list_doc_files(docs_dir='docs'):
+    paths = []
+    for file in sorted(os.listdir(docs_dir)):
+        path = os.path.join('.', docs_dir, file)
+        if os.path.isfile(path) and get_loader(path) is not None:
+            paths.append(path)
+    return paths
+
+
+# Cheap fingerprint of docs/ (names, sizes and mtimes only - no hashing), good
+# enough to tell whether the corpus needs another sync_vectordb() pass.
+def corpus_fingerprint(docs_dir='docs'):
+    sha = hashlib.sha1()
+    for path in list_doc_files(docs_dir):
+        stat = os.stat(path)
+        sha.update(f'{path}\0{stat.st_size}\0{stat.st_mtime}\n'.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def chunk_id(file_path, digest, index):
+    # the path is part of the ID so two identical files don't share chunks
+    prefix = hashlib.sha1(file_path.encode('utf-8')).hexdigest()[:12]
+    return f'{prefix}:{digest[:16]}:{index}'
+
+
+# Split pages one at a time as they come in, instead of the whole corpus at once
+def iter_chunks(pages, text_splitter):
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+# Embed and store a stream of chunks in batches of `batch_size`, so memory stays
+# flat and the first batch is embedded before the last file has been parsed.
+def upsert_in_batches(vectordb, chunks, batch_size=64):
+    batch, total = [], 0
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            vectordb.add_documents(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        vectordb.add_documents(batch)
+        total += len(batch)
+    return total
+
+
+# Compare docs/ against the manifest and return (added/changed, unchanged, deleted).
+# Files whose size and mtime didn't move are trusted without hashing them again.
+def diff_manifest(manifest, docs_dir='docs'):
+    known = manifest['files']
+    changed, unchanged = [], []
+    current = list_doc_files(docs_dir)
+    for path in current:
+        stat = os.stat(path)
+        entry = known.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            unchanged.append(path)
+            continue
+        digest = file_digest(path)
+        if entry and entry['sha256'] == digest:
+            # touched but not modified - just refresh the stat info
+            entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+            unchanged.append(path)
+            continue
+        changed.append((path, digest, stat))
+    deleted = [path for path in known if path not in current]
+    return changed, unchanged, deleted
+
+
+# Bring a persisted vector store in line with docs/: only added or changed
+# files are split and embedded, and chunks of changed/deleted files are removed.
+# Pages are streamed through the splitter and upserted in batches of
+# `batch_size` chunks; with `max_workers` set, the changed files are parsed in
+# parallel instead (load_docs.py).
+#
+# With `dedup` on, chunks that are near-duplicates of one already stored - in
+# this run or an earlier one (templated invoices...) - aren't embedded again:
+# the file just points at the existing chunk ID, whose 'duplicate_sources'
+# metadata is updated in the store, and a chunk is only deleted once no file
+# in the manifest refers to it any more.
+# The manifest is saved at most every `save_every` seconds while the run goes
+# on (and at the end); signatures only at the end - chunks of an interrupted
+# run just aren't matched against until their files change again.
+def sync_vectordb(vectordb, text_splitter, docs_dir='docs',
+                  manifest_path=MANIFEST_PATH, max_workers=None, batch_size=64,
+                  dedup=True, save_every=30):
+    manifest = load_manifest(manifest_path)
+    signatures = load_signatures(manifest_path)
+    signatures.update(manifest.pop('signatures', {}))  # where they used to be
+    if manifest['files'] and vectordb._collection.count() == 0:
+        # the collection was wiped out from under us - start over
+        manifest, signatures = {'files': {}}, {}
+
+    changed, unchanged, deleted = diff_manifest(manifest, docs_dir)
+    refs = Counter(i for entry in manifest['files'].values() for i in entry['chunk_ids'])
+    near_dups = NearDuplicateFilter() if dedup else None
+    merged = set()  # stored chunks that got another duplicate source since
+
+    def release(entry):
+        unused = []
+        for i in entry['chunk_ids']:
+            refs[i] -= 1
+            if refs[i] <= 0:
+                del refs[i]
+                unused.append(i)
+        if unused:
+            vectordb.delete(ids=unused)
+        for i in unused:
+            signatures.pop(i, None)
+            merged.discard(i)
+            if near_dups:
+                near_dups.discard(i)
+
+    for path in deleted:
+        release(manifest['files'].pop(path))
+
+    # the chunks of the unchanged files, for the changed ones to be checked
+    # against - not the old chunks of a changed file, or an edited chunk would
+    # match its old text and never be stored. Only their metadata is fetched.
+    if near_dups and changed:
+        stored = {i for path in unchanged for i in manifest['files'][path]['chunk_ids']}
+        stored = sorted(i for i in stored if i in signatures)
+        if stored:
+            found = vectordb._collection.get(ids=stored, include=['metadatas'])
+            for i, metadata in zip(found['ids'], found['metadatas']):
+                near_dups.add(i, signatures[i], Document(page_content='', metadata=metadata or {}))
+
+    changed_info = {path: (digest, stat) for path, digest, stat in changed}
+    changed_paths = [path for path, _, _ in changed]
+    if max_workers:
+        loaded = iter_files_parallel(changed_paths, max_workers=max_workers)
+    else:
+        loaded = ((path, iter_file_pages(path), None) for path in changed_paths)
+
+    batch_docs, batch_ids = [], []
+    finished = {}  # files whose chunks are all generated, waiting for the flush
+    last_save = time.monotonic()
+
+    def flush(final=False):
+        nonlocal last_save
+        if batch_docs:
+            vectordb.add_documents(batch_docs, ids=batch_ids)
+            batch_docs.clear()
+            batch_ids.clear()
+        if merged:
+            ids = sorted(merged)
+            vectordb._collection.update(ids=ids,
+                                        metadatas=[near_dups.get(i)[0].metadata for i in ids])
+            merged.clear()
+        # only record files once all their chunks are stored, and save as we
+        # go so an interrupted run doesn't re-embed finished files
+        manifest['files'].update(finished)
+        finished.clear()
+        if final or time.monotonic() - last_save >= save_every:
+            save_manifest(manifest, manifest_path)
+            last_save = time.monotonic()
+        if final:
+            save_signatures(signatures, manifest_path)
+
+    for path, pages, error in loaded:
+        digest, stat = changed_info[path]
+        ids, own_ids = [], []
+        try:
+            if error:
+                raise RuntimeError(error)
+            for n, chunk in enumerate(iter_chunks(pages, text_splitter)):
+                cid = chunk_id(path, digest, n)
+                shared = near_dups.check(chunk, key=cid) if near_dups else None
+                if shared is not None:
+                    if shared not in ids:
+                        ids.append(shared)
+                    if shared not in batch_ids:
+                        merged.add(shared)
+                    continue
+                ids.append(cid)
+                own_ids.append(cid)
+                batch_docs.append(chunk)
+                batch_ids.append(cid)
+                if len(batch_docs) >= batch_size:
+                    flush()
+        except Exception as e:
+            # drop what we have of this file; the manifest entry (and its old
+            # chunks) are left alone so it's retried next run
+            print(f"Skipping {path}: {e}")
+            own, pending_ids = set(own_ids), set(batch_ids)
+            stored = [i for i in own_ids if i not in pending_ids]
+            keep = [n for n, i in enumerate(batch_ids) if i not in own]
+            batch_docs[:] = [batch_docs[n] for n in keep]
+            batch_ids[:] = [batch_ids[n] for n in keep]
+            if stored:
+                vectordb.delete(ids=stored)
+            if near_dups:
+                for i in own_ids:
+                    near_dups.discard(i)
+                merged.difference_update(own_ids)
+            continue
+
+        old_entry = manifest['files'].get(path)
+        refs.update(ids)
+        if near_dups:
+            for i in own_ids:
+                signatures[i] = list(near_dups.get(i)[1])
+        if old_entry:
+            release(old_entry)
+        finished[path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': digest,
+            'chunk_ids': ids,
+        }
+
+    flush(final=True)
+    print(f"Ingestion: {len(changed)} added/changed, {len(deleted)} deleted, "
+          f"{len(unchanged)} unchanged")
+    if near_dups and near_dups.duplicates:
+        print(f"Ingestion: skipped {near_dups.duplicates} near-duplicate chunks")
+    return bool(changed or deleted)
@@ -1,24 +1,102 @@
 from langchain.document_loaders import PyPDFLoader
 from langchain.document_loaders import Docx2txtLoader
 from langchain.document_loaders import TextLoader
-import streamlit as st 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import streamlit as st
 import os
 
+# pick the right loader for a file based on its extension (None if unsupported)
+def get_loader(file_path):
+    if file_path.endswith('.pdf'):
+        return PyPDFLoader(file_path)
+    elif file_path.endswith('.docx') or file_path.endswith('.doc'):
+        return Docx2txtLoader(file_path)
+    elif file_path.endswith('.txt'):
+        return TextLoader(file_path)
+    return None
+
+# load a single file into a list of documents (pages)
+def load_file(file_path):
+    loader = get_loader(file_path)
+    if loader is None:
+        return []
+    return loader.load()
+
+# lazily yield the pages of a single file as they are parsed
+def iter_file_pages(file_path):
+    loader = get_loader(file_path)
+    if loader is not None:
+        yield from loader.lazy_load()
+
+# Stream the whole docs folder page by page, without holding it all in memory
+def iter_docs(docs_dir='docs'):
+    for file in sorted(os.listdir(docs_dir)):
+        yield from iter_file_pages(os.path.join('.', docs_dir, file))
+
+# same as load_file, but a broken file doesn't take the whole batch down with it
+def safe_load_file(file_path):
+    try:
+        return load_file(file_path), None
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+
+# Load several files at once: PDF parsing is CPU bound so it goes to a process
+# pool, DOCX/TXT loading is mostly I/O so a thread pool is enough.
+# Yields (path, documents, error) in the order of `paths`, whatever order the
+# workers finish in. Only about 2 * max_workers files are in flight at a time -
+# more are submitted as results are taken - so a slow consumer (embedding)
+# doesn't leave the whole parsed corpus waiting in memory. A worker process that
+# crashes (BrokenProcessPool) is reported as an error for the files it took
+# down, and the later PDFs get a fresh process pool.
+def iter_files_parallel(paths, max_workers=None):
+    window = 2 * (max_workers or os.cpu_count() or 1)
+    process_pool = ProcessPoolExecutor(max_workers=max_workers)
+    thread_pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending, paths = deque(), iter(paths)
+    try:
+        while True:
+            for path in itertools.islice(paths, window - len(pending)):
+                if not path.endswith('.pdf'):
+                    pending.append((path, thread_pool.submit(safe_load_file, path)))
+                    continue
+                try:
+                    future = process_pool.submit(safe_load_file, path)
+                except BrokenProcessPool:
+                    process_pool.shutdown(wait=False)
+                    process_pool = ProcessPoolExecutor(max_workers=max_workers)
+                    future = process_pool.submit(safe_load_file, path)
+                pending.append((path, future))
+            if not pending:
+                break
+            path, future = pending.popleft()
+            try:
+                docs, error = future.result()
+            except Exception as e:
+                docs, error = [], f"{type(e).__name__}: {e}"
+            yield path, docs, error
+    finally:
+        process_pool.shutdown(cancel_futures=True)
+        thread_pool.shutdown(cancel_futures=True)
+
+def load_files_parallel(paths, max_workers=None):
+    documents = []
+    for path, docs, error in iter_files_parallel(paths, max_workers=max_workers):
+        if error:
+            print(f"Skipping {path}: {error}")
+        documents.extend(docs)
+    return documents
+
 @st.cache_data()
-def load_docs():
+def load_docs(parallel=False, max_workers=None):
+    paths = ['./docs/' + file for file in sorted(os.listdir('docs'))]
+    if parallel:
+        return load_files_parallel(paths, max_workers=max_workers)
+
     documents = []
-    for file in os.listdir('docs'):
-        if file.endswith('.pdf'):
-            pdf_path = './docs/' + file
-            loader = PyPDFLoader(pdf_path)
-            documents.extend(loader.load())
-        elif file.endswith('.docx') or file.endswith('.doc'):
-            doc_path = './docs/' + file
-            loader = Docx2txtLoader(doc_path)
-            documents.extend(loader.load())
-        elif file.endswith('.txt'):
-            text_path = './docs/' + file
-            loader = TextLoader(text_path)
-            documents.extend(loader.load())
-            
-    return documents
\ No newline at end of file
+    for path in paths:
+        documents.extend(load_file(path))
+
+    return documents
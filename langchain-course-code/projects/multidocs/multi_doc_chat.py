@@ -6,7 +6,13 @@ from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores import Chroma
 from langchain.embeddings import OpenAIEmbeddings
-from load_docs import load_docs
+from ingest import corpus_fingerprint, sync_vectordb
+from history import ChatHistory
+from stream_handler import StreamHandler
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # for rag_helpers/
+from rag_helpers.embedding_cache import CachedEmbeddings
+from rag_helpers.hybrid_retriever import BM25Index, HybridRetriever
 from langchain.chains import ConversationalRetrievalChain
 import streamlit as st
 from streamlit_chat import message # pip install streamlit_chat
@@ -19,36 +25,63 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 
 #==== Using OpenAI Chat API =======
 llm_model = "gpt-3.5-turbo"
-llm = ChatOpenAI(temperature=0.0, model=llm_model)
 
 #### === packages to install ====
 # pip install langchain pypdf openai chromadb tiktoken docx2txt
 
-# load files
-documents = load_docs()
-chat_history = []
-
-# Now we split the data into chunks
-text_splitter = CharacterTextSplitter(
-    chunk_size=1200,
-    chunk_overlap=10
-)
-docs = text_splitter.split_documents(documents)
-
-# create our vector db chromadb
-vectordb = Chroma.from_documents(
-    documents=docs,
-    embedding=OpenAIEmbeddings(),
-    persist_directory='./data'
-)
-vectordb.persist()
-
-qa_chain = ConversationalRetrievalChain.from_llm(
-    llm,
-    vectordb.as_retriever(search_kwargs={'k': 6}),
-    return_source_documents=True,
-    verbose=False
-)
+# token budget for the chat history sent along with each question, and how
+# many turns we keep on screen
+history_max_tokens = 1000
+max_displayed_turns = 50
+
+# Streamlit re-runs this whole script on every chat message, so the heavy
+# objects (LLM, vector db, QA chain) are built once per process and shared by
+# every session. The corpus fingerprint is only cheap os.stat() calls; when it
+# changes (a file in docs/ was added, edited or removed) the cached chain is
+# thrown away and rebuilt.
+@st.cache_resource(max_entries=1, show_spinner="Indexing your documents...")
+def get_qa_chain(fingerprint):
+    # the answer LLM streams its tokens to the UI (see stream_handler.py); the
+    # question-condensing step uses a non-streaming LLM so its output doesn't
+    # show up in the chat
+    llm = ChatOpenAI(temperature=0.0, model=llm_model, streaming=True)
+    condense_llm = ChatOpenAI(temperature=0.0, model=llm_model)
+
+    # Now we split the data into chunks
+    text_splitter = CharacterTextSplitter(
+        chunk_size=1200,
+        chunk_overlap=10
+    )
+
+    # open the persisted vector db chromadb and only (re-)embed files in docs/
+    # that were added, changed or deleted since the last run (see ingest.py)
+    vectordb = Chroma(
+        embedding_function=CachedEmbeddings(OpenAIEmbeddings()),
+        persist_directory='./data'
+    )
+    changed = sync_vectordb(vectordb, text_splitter, docs_dir='docs', max_workers=4)
+    if changed:
+        vectordb.persist()
+
+    # BM25 keyword index over the same chunks, so exact tokens (invoice IDs,
+    # policy numbers...) are found even when the embeddings miss them
+    bm25_path = './data/bm25.json.gz'
+    if changed or not os.path.exists(bm25_path):
+        bm25_index = BM25Index.from_chroma(vectordb)
+        bm25_index.save(bm25_path)
+    else:
+        bm25_index = BM25Index.load(bm25_path)
+
+    return ConversationalRetrievalChain.from_llm(
+        llm,
+        HybridRetriever(vector_retriever=vectordb.as_retriever(search_kwargs={'k': 6}),
+                        bm25_index=bm25_index, k=6),
+        condense_question_llm=condense_llm,
+        return_source_documents=True,
+        verbose=False
+    )
+
+qa_chain = get_qa_chain(corpus_fingerprint('docs'))
 
 
 #==== Streamlit front-end ====
@@ -60,6 +93,10 @@ if 'generated' not in st.session_state:
     
 if 'past' not in st.session_state:
     st.session_state['past'] = []
+
+# each session gets its own, token-bounded history (see history.py)
+if 'chat_history' not in st.session_state:
+    st.session_state['chat_history'] = ChatHistory(max_tokens=history_max_tokens)
     
 def get_query():
     input_text = st.chat_input("Ask a question about your documents...")
@@ -69,9 +106,18 @@ def get_query():
 # retrieve the user input
 user_input = get_query()
 if user_input:
-    result = qa_chain({'question': user_input, 'chat_history': chat_history})
+    chat_history = st.session_state['chat_history']
+    # stream the answer into the page while it is generated
+    answer_box = st.empty()
+    sources_box = st.empty()
+    result = qa_chain({'question': user_input, 'chat_history': chat_history.window()},
+                      callbacks=[StreamHandler(answer_box, sources_box)])
+    answer_box.empty() # the finished answer is rendered with the rest of the chat below
+    chat_history.add(user_input, result['answer'])
     st.session_state.past.append(user_input)
     st.session_state.generated.append(result['answer'])
+    del st.session_state.past[:-max_displayed_turns]
+    del st.session_state.generated[:-max_displayed_turns]
     
     
 if st.session_state['generated']:
@@ -0,0 +1,31 @@
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+# Pushes answer tokens into a Streamlit placeholder as the LLM generates them,
+# and lists the source documents as soon as the retriever returns them - long
+# before the answer is finished.
+#
+#   handler = StreamHandler(st.empty(), st.empty())
+#   qa_chain({...}, callbacks=[handler])
+class StreamHandler(BaseCallbackHandler):
+
+    def __init__(self, answer_container, sources_container=None):
+        self.answer_container = answer_container
+        self.sources_container = sources_container
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        self.answer_container.markdown(self.text + "▌")
+
+    def on_retriever_end(self, documents, **kwargs):
+        if self.sources_container is None:
+            return
+        sources = []
+        for doc in documents:
+            source = doc.metadata.get('source', 'unknown')
+            if 'page' in doc.metadata:
+                source += f" (page {doc.metadata['page'] + 1})"
+            if source not in sources:
+                sources.append(source)
+        self.sources_container.caption("Sources: " + ", ".join(sources))
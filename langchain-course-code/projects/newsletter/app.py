@@ -1,6 +1,8 @@
+import asyncio
 import os
 import streamlit as st 
 from helpers import *
+from pipeline import run_newsletter
 
 
 
@@ -19,11 +21,12 @@ def main():
         with st.spinner(f"Generating newsletter for {query}"):
             #st.write("Generating newsletter for: ", query)
             
-            search_results = search_serp(query=query)
-            urls = pick_best_articles_urls(response_json=search_results, query=query)
-            data = extract_content_from_urls(urls)
-            summaries = summarizer(data, query)
-            newsletter_thread = generate_newsletter(summaries, query)
+            # every article is fetched, embedded and summarized as soon as
+            # the picker names it (see pipeline.py)
+            result = asyncio.run(run_newsletter(query))
+            search_results, urls = result['search_results'], result['urls']
+            data, summaries = result['db'], result['summaries']
+            newsletter_thread = result['newsletter']
             
             with st.expander("Search Results"):
                 st.info(search_results)
@@ -31,6 +34,7 @@ def main():
                 st.info(urls)
             with st.expander("Data"):
                 # iterate through data in the FAISS db and return the similiarity search data to show!
+                # (a TopicSession: the query is already embedded, the search memoized)
                 data_raw = " ".join(d.page_content for d in data.similarity_search(query,k=4))
                 st.info(data_raw)
             with st.expander("Summaries"):
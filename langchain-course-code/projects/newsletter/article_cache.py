@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'articles')
+
+
+# What we know about every article we've downloaded, for the fetcher to
+# revalidate it with a conditional GET instead of downloading it again:
+#   urls   - per url: ETag / Last-Modified validators and the sha256 of the body
+#   bodies - per content hash: the raw page, gzipped (<hash>.html.gz)
+#   texts  - per content hash: the clean text the page was parsed into
+# A page that comes back 304 (or 200 with the same bytes, from a server that
+# sends no validators) isn't parsed again; its chunks then have the same text
+# too, so their embeddings come straight from CachedEmbeddings.
+class ArticleCache:
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'),
+                                    check_same_thread=False, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                encoding TEXT,
+                content_hash TEXT NOT NULL,
+                fetched REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS texts (
+                content_hash TEXT PRIMARY KEY,
+                texts TEXT NOT NULL);
+        """)
+
+    def _body_path(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash + '.html.gz')
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            self.conn.commit()
+        return rows
+
+    # (content hash, encoding) of the last copy of `url`, or None
+    def lookup(self, url):
+        rows = self._execute('SELECT content_hash, encoding FROM urls WHERE url = ?', (url,))
+        if not rows or not os.path.exists(self._body_path(rows[0][0])):
+            return None
+        return rows[0]
+
+    # If-None-Match / If-Modified-Since headers for a conditional GET of `url`
+    def validators(self, url):
+        rows = self._execute('SELECT etag, last_modified, content_hash FROM urls WHERE url = ?',
+                             (url,))
+        if not rows or not os.path.exists(self._body_path(rows[0][2])):
+            return {}
+        etag, last_modified, _ = rows[0]
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    # remember a 200 response; returns the content hash of the body
+    def store(self, url, body, etag=None, last_modified=None, encoding=None):
+        content_hash = hashlib.sha256(body).hexdigest()
+        path = self._body_path(content_hash)
+        if not os.path.exists(path):
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        self._execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?)',
+                      (url, etag, last_modified, encoding, content_hash, time.time()))
+        return content_hash
+
+    # the server said 304 - our copy is still current
+    def touch(self, url):
+        self._execute('UPDATE urls SET fetched = ? WHERE url = ?', (time.time(), url))
+
+    def body(self, content_hash):
+        with gzip.open(self._body_path(content_hash), 'rb') as f:
+            return f.read()
+
+    def texts(self, content_hash):
+        rows = self._execute('SELECT texts FROM texts WHERE content_hash = ?', (content_hash,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def store_texts(self, content_hash, texts):
+        self._execute('INSERT OR REPLACE INTO texts VALUES (?, ?)',
+                      (content_hash, json.dumps(texts)))
@@ -0,0 +1,150 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain.docstore.document import Document
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; newsletter-researcher/1.0)',
+           'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8'}
+
+
+# html -> one Document, the same way UnstructuredURLLoader does it
+def parse_html(url, html):
+    from unstructured.partition.html import partition_html
+    elements = partition_html(text=html)
+    text = "\n\n".join(str(element) for element in elements)
+    return [Document(page_content=text, metadata={'source': url})]
+
+
+# the socket timeout for the next read of a streamed response (best effort -
+# it relies on urllib3 keeping the connection on the response)
+def _set_read_timeout(response, seconds):
+    connection = getattr(response.raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        sock.settimeout(max(seconds, 0.001))
+
+
+# Concurrent article downloader. One requests.Session is shared by every
+# worker, so connections to a site are kept alive and reused; at most
+# `per_host` requests go to the same host at a time. Each URL gets `timeout`
+# seconds in total (connect + download, not per socket read) and at most
+# `max_bytes` of body, and is parsed by the worker as soon as it's downloaded.
+# A URL that fails is reported and skipped - it never stops the others.
+# With an ArticleCache, pages we have already are revalidated with a
+# conditional GET and not parsed again (see article_cache.py).
+#
+#   fetcher = ArticleFetcher(cache=ArticleCache())
+#   for url, docs, error in fetcher.fetch(urls):
+#       ...
+class ArticleFetcher:
+
+    def __init__(self, max_workers=8, per_host=2, timeout=15, connect_timeout=5,
+                 max_bytes=5_000_000, parse=parse_html, cache=None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_bytes = max_bytes
+        self.parse = parse
+        self.cache = cache
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers,
+                              max_retries=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.lock = threading.Lock()
+        self.host_slots = {}
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    # Returns (status, body bytes, encoding, response headers) - stops reading
+    # once the deadline or size cap is hit. `headers` go with the request
+    # (e.g. the validators for a conditional GET).
+    # requests' read timeout is per socket read, so before every chunk it is
+    # cut down to what is left of the deadline - a server trickling bytes can't
+    # keep us past `timeout` (plus the connect time, for the headers).
+    def download(self, url, headers=None):
+        with self._host_slot(url):
+            deadline = time.monotonic() + self.timeout
+            with self.session.get(url, headers=headers, stream=True,
+                                  timeout=(min(self.connect_timeout, self.timeout),
+                                           self.timeout)) as response:
+                response.raise_for_status()
+                body = bytearray()
+                chunks = response.iter_content(chunk_size=64 * 1024)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"took longer than {self.timeout}s")
+                    _set_read_timeout(response, remaining)
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        raise ValueError(f"larger than {self.max_bytes} bytes")
+                # without a charset in the header, requests assumes latin-1 for html
+                if 'charset' in response.headers.get('Content-Type', '').lower():
+                    encoding = response.encoding
+                else:
+                    encoding = response.apparent_encoding if body else None
+                return response.status_code, bytes(body), encoding, response.headers
+
+    # the page's documents - from the cache when the server says our copy is
+    # current (304) or sends the same bytes again
+    def _load_url(self, url):
+        if self.cache is None:
+            _, body, encoding, _ = self.download(url)
+            return self.parse(url, body.decode(encoding or 'utf-8', errors='replace'))
+
+        status, body, encoding, headers = self.download(url, self.cache.validators(url))
+        cached = self.cache.lookup(url) if status == 304 else None
+        if cached:
+            content_hash, encoding = cached
+            self.cache.touch(url)
+            body = None
+        else:
+            if status == 304:  # lost our copy - get the whole page after all
+                status, body, encoding, headers = self.download(url)
+            content_hash = self.cache.store(url, body, headers.get('ETag'),
+                                            headers.get('Last-Modified'), encoding)
+
+        texts = self.cache.texts(content_hash)
+        if texts is not None:
+            return [Document(page_content=text, metadata={'source': url}) for text in texts]
+        if body is None:
+            body = self.cache.body(content_hash)
+        docs = self.parse(url, body.decode(encoding or 'utf-8', errors='replace'))
+        self.cache.store_texts(content_hash, [doc.page_content for doc in docs])
+        return docs
+
+    def _fetch_one(self, url):
+        try:
+            return url, self._load_url(url), None
+        except Exception as e:
+            print(f"Failed to fetch {url}: {e}")
+            return url, [], e
+
+    # yields (url, [Document], error) for each url as soon as it's done
+    def fetch(self, urls):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._fetch_one, url) for url in dict.fromkeys(urls)]
+            for future in as_completed(futures):
+                yield future.result()
+
+    # every url's documents, in the order the urls were given
+    def load(self, urls):
+        results = {url: docs for url, docs, _ in self.fetch(urls)}
+        return [doc for url in dict.fromkeys(urls) for doc in results[url]]
@@ -3,24 +3,46 @@ from dotenv import find_dotenv, load_dotenv
 import openai
 import json
 import requests
+import hashlib
+import tiktoken
+from concurrent.futures import ThreadPoolExecutor
 from langchain import LLMChain, OpenAI, PromptTemplate
 from langchain.chat_models import ChatOpenAI
-from langchain.document_loaders import UnstructuredURLLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.utilities import GoogleSerperAPIWrapper
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # for rag_helpers/
+from rag_helpers.embedding_cache import CachedEmbeddings
+from rag_helpers.dedup import dedupe_documents
+from fetcher import ArticleFetcher
+from article_cache import ArticleCache
+from ttl_cache import TTLCache
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 SERP_API_KEY = os.getenv("SERPER_API_KEY")
 
 load_dotenv(find_dotenv())
 
-embeddings = OpenAIEmbeddings()
+embeddings = CachedEmbeddings(OpenAIEmbeddings()) # cached on disk, see rag_helpers/
+fetcher = ArticleFetcher(cache=ArticleCache()) # pooled, revalidated downloads - see fetcher.py
+# search results and article picks per topic: fresh for an hour, then served
+# stale (and refreshed in the background) for a day - see ttl_cache.py
+query_cache = TTLCache(ttl=3600, stale_ttl=24 * 3600)
+# partial summaries per chunk hash - the same chunks give the same summary
+summary_cache = TTLCache(path=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                           '.cache', 'summaries.sqlite'),
+                         ttl=30 * 24 * 3600, stale_ttl=0)
+
+ENCODING = tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+def count_tokens(text):
+    return len(ENCODING.encode(text))
 
 
 # 1. Serp request to get list of relevant articles
-def search_serp(query):
+def _search_serp(query):
     search = GoogleSerperAPIWrapper(k=5, type="search")
     response_json = search.results(query)
     
@@ -28,14 +50,11 @@ def search_serp(query):
     
     return response_json
 
+def search_serp(query):
+    return query_cache.get_or_compute('search', query, lambda: _search_serp(query))
+
 # 2. llm to choose the best articles, and return urls
-def pick_best_articles_urls(response_json, query):
-    # turn json to string
-    response_str = json.dumps(response_json)
-    
-    # create llm to choose best articles
-    llm = ChatOpenAI(temperature=0.7)
-    template = """ 
+PICK_ARTICLES_TEMPLATE = """ 
       You are a world class journalist, researcher, tech, Software Engineer, Developer and a online course creator
       , you are amazing at finding the most interesting and relevant, useful articles in certain topics.
       
@@ -49,9 +68,20 @@ def pick_best_articles_urls(response_json, query):
       Also make sure the articles are recent and not too old.
       If the file, or URL is invalid, show www.google.com.
     """
+
+# the picker prompt as plain text (used when streaming the picker's answer)
+def picker_prompt(response_json, query):
+    return PICK_ARTICLES_TEMPLATE.format(response_str=json.dumps(response_json), query=query)
+
+def _pick_best_articles_urls(response_json, query):
+    # turn json to string
+    response_str = json.dumps(response_json)
+    
+    # create llm to choose best articles
+    llm = ChatOpenAI(temperature=0.7)
     prompt_template = PromptTemplate(
         input_variables=["response_str", "query"],
-        template= template
+        template=PICK_ARTICLES_TEMPLATE
     )
     article_chooser_chain = LLMChain(
         llm=llm,
@@ -66,33 +96,33 @@ def pick_best_articles_urls(response_json, query):
     #print(url_list)
     return url_list
 
+def pick_best_articles_urls(response_json, query):
+    return query_cache.get_or_compute('picks', query,
+                                      lambda: _pick_best_articles_urls(response_json, query))
+
 # 3. Get content for each article from urls and make summaries
+text_splitter = CharacterTextSplitter(
+    separator="\n",
+    chunk_size=1000,
+    chunk_overlap=200,
+    length_function=len
+)
+
 def extract_content_from_urls(urls):
-    # use unstructuredURLLoader
-    loader = UnstructuredURLLoader(urls=urls)
-    data = loader.load()
+    # all articles are downloaded at once (and parsed as each one arrives); a
+    # site that is down or too slow is skipped instead of failing the newsletter
+    data = fetcher.load(urls)
+    if not data:
+        raise ValueError(f"Could not fetch any of the articles: {urls}")
     
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    docs = text_splitter.split_documents(data)
+    # the same story is often syndicated on several sites - embed it once
+    docs = dedupe_documents(text_splitter.split_documents(data))
     db = FAISS.from_documents(docs, embeddings) # if libmagic issues: https://github.com/Yelp/elastalert/issues/1927
     
     return db 
 
-# 4. summarize the articles...
-def summarizer(db, query, k=4):
-    
-    docs = db.similarity_search(query, k=k)
-    
-    # Join the content of the page_content attribute from eac document...
-    docs_page_content = " ".join([d.page_content for d in docs])
-    
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=.7)
-    template = """
+# 4. summarize the articles... (`db` can also be a TopicSession)
+SUMMARY_TEMPLATE = """
        {docs}
         As a world class journalist, researcher, article, newsletter and blog writer, 
         you will summarize the text above in order to create a 
@@ -110,15 +140,92 @@ def summarizer(db, query, k=4):
         
         SUMMARY:
     """
+
+# the map step of map_reduce: one article (or part of one) at a time
+PARTIAL_SUMMARY_TEMPLATE = """
+       {docs}
+        As a world class journalist and researcher, summarize the text above for a
+        newsletter around {query}. Keep the facts, numbers, names, resources and
+        links that matter for {query} and leave out everything else.
+        
+        SUMMARY:
+    """
+
+def summary_chain(template=SUMMARY_TEMPLATE):
+    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=.7)
     prompt_template = PromptTemplate(input_variables=["docs", "query"],
                                      template=template)
+    return LLMChain(llm=llm, prompt=prompt_template, verbose=True)
+
+# summary of `texts` for `query`, cached by the hash of the texts and prompt
+def cached_summary(texts, query, template=SUMMARY_TEMPLATE):
+    key = hashlib.sha256("\x00".join([template, query] + list(texts)).encode("utf-8")).hexdigest()
+    def summarize():
+        response = summary_chain(template).run(docs=" ".join(texts), query=query)
+        return response.replace("\n", "")
+    return summary_cache.get_or_compute('summary', key, summarize)
+
+# split texts into consecutive groups of at most `max_tokens` (a text that is
+# too big on its own still gets a group of its own)
+def group_texts(texts, max_tokens):
+    groups, current, used = [], [], 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and used + tokens > max_tokens:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+# modes: "stuff" puts the top `k` chunks into one summary request; "map_reduce"
+# summarizes each article's chunks (`group_tokens` at a time) on its own, up to
+# `max_workers` at once, and then combines those partial summaries - first
+# collapsing them into fewer until they fit in `reduce_tokens`. map_reduce is
+# meant for a bigger `k` (more sources) than one request could take
+def summarizer(db, query, k=4, mode="stuff", max_workers=4, group_tokens=2000,
+               reduce_tokens=3000):
+    
+    docs = db.similarity_search(query, k=k)
+    
+    if mode == "map_reduce":
+        return map_reduce_summary(docs, query, max_workers, group_tokens, reduce_tokens)
+    
+    # Join the content of the page_content attribute from eac document...
+    docs_page_content = " ".join([d.page_content for d in docs])
     
-    summarizer_chain = LLMChain(llm=llm, prompt=prompt_template, verbose=True)
+    summarizer_chain = summary_chain()
     
     response = summarizer_chain.run(docs=docs_page_content, query=query)
     
     return response.replace("\n", "") # reponse, docs
 
+def map_reduce_summary(docs, query, max_workers=4, group_tokens=2000, reduce_tokens=3000):
+    by_source = {}
+    for doc in docs:
+        by_source.setdefault(doc.metadata.get('source'), []).append(doc.page_content)
+    groups = [group for texts in by_source.values() for group in group_texts(texts, group_tokens)]
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        partials = list(pool.map(lambda texts: cached_summary(texts, query, PARTIAL_SUMMARY_TEMPLATE),
+                                 groups))
+    
+    return cached_summary(collapse_summaries(partials, query, max_workers, reduce_tokens), query)
+
+# the reduce step: summaries are summarized together, `reduce_tokens` worth at a
+# time, until all of them fit in `reduce_tokens` (or can't be collapsed further)
+def collapse_summaries(summaries, query, max_workers=4, reduce_tokens=3000):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while sum(count_tokens(s) for s in summaries) > reduce_tokens:
+            groups = group_texts(summaries, reduce_tokens)
+            if len(groups) == len(summaries):  # can't collapse them any further
+                break
+            summaries = list(pool.map(
+                lambda texts: cached_summary(texts, query, PARTIAL_SUMMARY_TEMPLATE), groups))
+    return summaries
+
 # 5. Turn summarization into newsletter (or article...)
 def generate_newsletter(summaries, query):
     summaries_str = str(summaries)
@@ -0,0 +1,157 @@
+import asyncio
+import re
+
+import numpy as np
+from langchain.chat_models import ChatOpenAI
+from langchain.vectorstores import FAISS
+
+from helpers import (_pick_best_articles_urls, cached_summary, collapse_summaries, embeddings,
+                     fetcher, generate_newsletter, picker_prompt, query_cache, search_serp,
+                     text_splitter)
+from topic_session import TopicSession
+from rag_helpers.dedup import NearDuplicateFilter  # importable once helpers set sys.path
+
+_URL = re.compile(r'["\'](https?://[^"\'\s]+)["\']')
+
+
+# Overlapped version of the helpers.py steps. Instead of waiting for each step
+# to finish for every article, each url the picker writes out starts its own
+# task right away - fetch, chunk, embed, summarize - while the picker is
+# still answering and the other articles are still downloading. Only the
+# newsletter itself waits for all of them, so the whole run takes about as long
+# as the slowest article rather than the sum of the steps. When the topic's
+# picks are cached and an earlier run saved the index of those articles (see
+# topic_session.py), nothing is fetched or embedded: each article is summarized
+# from the saved chunks.
+# The article summaries are collapsed (helpers.collapse_summaries) until they
+# fit in `reduce_tokens` before the newsletter is written from them, so more or
+# longer articles don't overflow the newsletter prompt.
+#
+#   result = asyncio.run(run_newsletter(query))
+#   result['newsletter'], result['summaries'], result['db'] (a TopicSession), ...
+
+
+# the topic's article picks from the cache (refreshed in the background once
+# stale), or None when the picker has to be asked
+def cached_article_urls(response_json, query):
+    state, cached = query_cache.lookup('picks', query)
+    if state == 'stale':
+        query_cache.refresh('picks', query,
+                            lambda: _pick_best_articles_urls(response_json, query))
+    return None if state == 'miss' else cached
+
+
+# urls from the picker's answer, each one as soon as it has been written out
+async def stream_article_urls(response_json, query):
+    llm = ChatOpenAI(temperature=0.7)
+    buffer, seen = '', []
+    async for chunk in llm.astream(picker_prompt(response_json, query)):
+        buffer += chunk.content
+        for url in _URL.findall(buffer):
+            if url not in seen:
+                seen.append(url)
+                yield url
+    if seen:
+        query_cache.store('picks', query, seen)
+
+
+# the chunks of one article, embedded as a batch; what we already have from
+# another article (a syndicated copy) is left out
+async def embed_article(url, near_dups):
+    docs = await asyncio.to_thread(fetcher.load, [url])
+    chunks = [chunk for chunk in text_splitter.split_documents(docs)
+              if near_dups.check(chunk) is None]
+    if not chunks:
+        return [], []
+    vectors = await asyncio.to_thread(embeddings.embed_documents,
+                                      [chunk.page_content for chunk in chunks])
+    return chunks, vectors
+
+
+# the article's `k` chunks closest to the query, summarized
+async def summarize_article(chunks, vectors, query_vector, query, k=4):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+    scores = matrix @ query_vector / (norms + 1e-9)
+    best = [chunks[n] for n in np.argsort(-scores)[:k]]
+    # cached per chunk hash, so unchanged articles aren't summarized again
+    return await asyncio.to_thread(cached_summary, [d.page_content for d in best], query)
+
+
+# the same, from the saved index of an earlier run on these articles
+async def summarize_saved_article(session, url, query, k=4):
+    docs = await asyncio.to_thread(session.article_search, url, k)
+    if not docs:
+        return None
+    return await asyncio.to_thread(cached_summary, [d.page_content for d in docs], query)
+
+
+async def run_newsletter(query, k=4, reduce_tokens=3000):
+    search_results = await asyncio.to_thread(search_serp, query)
+    query_vector = asyncio.create_task(asyncio.to_thread(embeddings.embed_query, query))
+    near_dups = NearDuplicateFilter()
+
+    async def process(url):
+        try:
+            chunks, vectors = await embed_article(url, near_dups)
+        except Exception as e:
+            print(f"Skipping {url}: {e}")
+            return [], [], None
+        if not chunks:
+            return [], [], None
+        try:
+            summary = await summarize_article(chunks, vectors,
+                                              np.asarray(await query_vector, dtype=np.float32),
+                                              query, k)
+        except Exception as e:
+            print(f"Could not summarize {url}: {e}")
+            summary = None
+        return chunks, vectors, summary
+
+    # with the picks cached, the urls are known up front - and if an earlier
+    # run saved the index of these articles, nothing is fetched or embedded
+    picks = cached_article_urls(search_results, query)
+    session = None
+    if picks:
+        session = await asyncio.to_thread(TopicSession.load, query, picks, embeddings,
+                                          query_vector=await query_vector)
+    if session is not None:
+        urls = picks
+
+        async def summarize_saved(url):
+            try:
+                return await summarize_saved_article(session, url, query, k)
+            except Exception as e:
+                print(f"Could not summarize {url}: {e}")
+                return None
+
+        summaries = [s for s in await asyncio.gather(*map(summarize_saved, urls)) if s]
+    else:
+        urls, tasks = [], []
+        if picks is not None:
+            for url in picks:
+                urls.append(url)
+                tasks.append(asyncio.create_task(process(url)))
+        else:
+            async for url in stream_article_urls(search_results, query):
+                urls.append(url)
+                tasks.append(asyncio.create_task(process(url)))
+        results = await asyncio.gather(*tasks)
+
+        chunks = [chunk for article_chunks, _, _ in results for chunk in article_chunks]
+        vectors = [vector for _, article_vectors, _ in results for vector in article_vectors]
+        summaries = [summary for _, _, summary in results if summary]
+        if not chunks:
+            raise ValueError(f"Could not fetch any of the articles: {urls}")
+
+        # the index the app shows the top chunks from, built from the vectors
+        # we already have and saved for the next run on these articles
+        db = FAISS.from_embeddings(list(zip((c.page_content for c in chunks), vectors)),
+                                   embeddings, metadatas=[c.metadata for c in chunks])
+        session = TopicSession(query, urls, db, embeddings, query_vector=await query_vector)
+        session.save()
+    reduced = await asyncio.to_thread(collapse_summaries, summaries, query,
+                                      reduce_tokens=reduce_tokens)
+    newsletter = await asyncio.to_thread(generate_newsletter, reduced, query)
+    return {'search_results': search_results, 'urls': urls, 'db': session,
+            'summaries': summaries, 'newsletter': newsletter}
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import time
+
+from langchain.vectorstores import FAISS
+
+from ttl_cache import normalize_query
+
+TOPICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'topics')
+
+
+# Everything retrieval needs for one newsletter topic: the FAISS index of its
+# articles and the embedded query. The query is embedded once, and each
+# (query, k) search is only run once. It has FAISS's similarity_search(query, k),
+# so it can be passed wherever the index was.
+# The index can be saved per topic and loaded again on a later run, as long as
+# it was built from the same articles and is under `max_age` seconds old - then
+# the articles don't need to be fetched or embedded again: article_search()
+# gives each one's chunks to summarize.
+#
+#   session = TopicSession.load(query, urls, embeddings) or TopicSession(query, urls, db, embeddings)
+#   session.save()
+#   docs = session.similarity_search(query, k=4)
+class TopicSession:
+
+    def __init__(self, query, urls, db, embeddings, query_vector=None):
+        self.query = query
+        self.urls = list(urls)
+        self.db = db
+        self.embeddings = embeddings
+        self.query_vectors = {}
+        if query_vector is not None:
+            self.query_vectors[normalize_query(query)] = list(query_vector)
+        self.results = {}
+
+    @staticmethod
+    def path(query):
+        name = hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+        return os.path.join(TOPICS_DIR, name)
+
+    def query_vector(self, query=None):
+        key = normalize_query(query or self.query)
+        if key not in self.query_vectors:
+            self.query_vectors[key] = self.embeddings.embed_query(query or self.query)
+        return self.query_vectors[key]
+
+    def similarity_search(self, query=None, k=4):
+        key = (normalize_query(query or self.query), k)
+        if key not in self.results:
+            self.results[key] = self.db.similarity_search_by_vector(self.query_vector(query), k=k)
+        return self.results[key]
+
+    # the `k` chunks of the article at `url` closest to the topic's query
+    def article_search(self, url, k=4):
+        return self.db.similarity_search_by_vector(self.query_vector(), k=k,
+                                                   filter={'source': url},
+                                                   fetch_k=self.db.index.ntotal)
+
+    def save(self):
+        path = self.path(self.query)
+        self.db.save_local(path)
+        with open(os.path.join(path, 'topic.json'), 'w') as f:
+            json.dump({'query': self.query, 'urls': self.urls, 'saved': time.time()}, f)
+
+    # the saved session for `query`, if it covers the same `urls` and isn't too old
+    @classmethod
+    def load(cls, query, urls, embeddings, max_age=24 * 3600, query_vector=None):
+        path = cls.path(query)
+        meta_path = os.path.join(path, 'topic.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if sorted(meta['urls']) != sorted(urls) or time.time() - meta['saved'] > max_age:
+            return None
+        # we wrote this index ourselves, so unpickling its docstore is safe
+        db = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        return cls(query, urls, db, embeddings, query_vector)
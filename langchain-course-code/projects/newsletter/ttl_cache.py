@@ -0,0 +1,90 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'queries.sqlite')
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+# Persistent cache for answers that only change slowly - search results and
+# the article picks for a topic - keyed by the normalized query, so
+# "Flutter news " and "flutter news" share an entry. Up to `ttl` seconds old an
+# entry is served as is; up to `ttl + stale_ttl` it is still served right away
+# but refreshed in a background thread for next time (stale-while-revalidate);
+# older than that it is recomputed before returning.
+#
+#   cache = TTLCache()
+#   results = cache.get_or_compute('search', query, lambda: search(query))
+class TTLCache:
+
+    def __init__(self, path=CACHE_PATH, ttl=3600, stale_ttl=24 * 3600):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (namespace, key))""")
+        self.conn.commit()
+
+    # ('fresh' | 'stale' | 'miss', value)
+    def lookup(self, namespace, key):
+        with self.lock:
+            row = self.conn.execute('SELECT value, created FROM entries '
+                                    'WHERE namespace = ? AND key = ?',
+                                    (namespace, normalize_query(key))).fetchone()
+        if row is None:
+            return 'miss', None
+        age = time.time() - row[1]
+        if age < self.ttl:
+            return 'fresh', json.loads(row[0])
+        if age < self.ttl + self.stale_ttl:
+            return 'stale', json.loads(row[0])
+        return 'miss', None
+
+    def store(self, namespace, key, value):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                              (namespace, normalize_query(key), json.dumps(value), time.time()))
+            self.conn.commit()
+
+    # recompute an entry in the background (once, however many callers ask)
+    def refresh(self, namespace, key, compute):
+        slot = (namespace, normalize_query(key))
+        with self.lock:
+            if slot in self.refreshing:
+                return
+            self.refreshing.add(slot)
+
+        def run():
+            try:
+                self.store(namespace, key, compute())
+            except Exception as e:
+                print(f"Background refresh of {namespace}:{key} failed: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(slot)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get_or_compute(self, namespace, key, compute):
+        state, value = self.lookup(namespace, key)
+        if state == 'stale':
+            self.refresh(namespace, key, compute)
+        if state != 'miss':
+            return value
+        value = compute()
+        self.store(namespace, key, value)
+        return value
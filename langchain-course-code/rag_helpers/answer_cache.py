@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain.schema import Document
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  '..', 'data', 'answer_cache.sqlite')
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split()).rstrip('?!. ')
+
+
+def _sha(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# fingerprint of the retrieved context - changes whenever the index does
+def context_fingerprint(docs):
+    parts = [_sha(d.page_content + json.dumps(d.metadata, sort_keys=True, default=str))
+             for d in docs]
+    return _sha('\n'.join(parts))
+
+
+# Answer cache around a RetrievalQA chain (e.g. RetrievalQA.from_chain_type(...)).
+# Retrieval still runs on every call - it's cheap - but the LLM call is skipped
+# when the same (normalized query, retrieved chunks, prompt, model) was seen
+# before. Because the retrieved chunks are part of the key, re-indexing the
+# documents invalidates stale answers by itself.
+#
+#   qa_chain = CachedRetrievalQA(RetrievalQA.from_chain_type(llm, retriever=...))
+#   result = qa_chain("who is the CV about?")  # {'query', 'result', 'source_documents'}
+class CachedRetrievalQA:
+
+    def __init__(self, qa_chain, cache_path=DEFAULT_CACHE_PATH):
+        self.qa_chain = qa_chain
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS answers '
+                           '(key TEXT PRIMARY KEY, result TEXT NOT NULL, '
+                           'sources TEXT NOT NULL, created REAL NOT NULL)')
+        self._conn.commit()
+        self._chain_fingerprint = self._fingerprint_chain()
+
+    def _fingerprint_chain(self):
+        combine_chain = self.qa_chain.combine_documents_chain
+        llm_chain = getattr(combine_chain, 'llm_chain', None)
+        if llm_chain is None:
+            return _sha(repr(combine_chain))
+        llm = llm_chain.llm
+        model = getattr(llm, 'model_name', None) or type(llm).__name__
+        return _sha(json.dumps({
+            'chain': type(combine_chain).__name__,
+            'prompt': repr(llm_chain.prompt),
+            'model': model,
+            'temperature': getattr(llm, 'temperature', None),
+        }, sort_keys=True))
+
+    def cache_key(self, query, docs):
+        return _sha('\n'.join([normalize_query(query), context_fingerprint(docs),
+                               self._chain_fingerprint]))
+
+    def __call__(self, query):
+        if isinstance(query, dict):
+            query = query[self.qa_chain.input_key]
+        docs = self.qa_chain.retriever.get_relevant_documents(query)
+        key = self.cache_key(query, docs)
+
+        with self._lock:
+            row = self._conn.execute('SELECT result, sources FROM answers WHERE key = ?',
+                                     (key,)).fetchone()
+        if row:
+            self.hits += 1
+            result = row[0]
+            sources = [Document(page_content=s['page_content'], metadata=s['metadata'])
+                       for s in json.loads(row[1])]
+        else:
+            self.misses += 1
+            # reuse the docs we already retrieved instead of letting the chain
+            # run retrieval a second time
+            result = self.qa_chain.combine_documents_chain.run(
+                input_documents=docs, question=query)
+            sources = docs
+            stored = json.dumps([{'page_content': d.page_content, 'metadata': d.metadata}
+                                 for d in docs], default=str)
+            with self._lock:
+                self._conn.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)',
+                                   (key, result, stored, time.time()))
+                self._conn.commit()
+
+        response = {self.qa_chain.input_key: query, self.qa_chain.output_key: result}
+        if self.qa_chain.return_source_documents:
+            response['source_documents'] = sources
+        return response
@@ -0,0 +1,120 @@
+import random
+import re
+import zlib
+from collections import defaultdict
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingles(text, size=5):
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+# Collapses near-duplicate chunks (templated invoices, boilerplate footers, the
+# same article syndicated on two sites...) before they get embedded.
+#
+# Each chunk gets a MinHash signature of its word shingles; LSH banding finds
+# candidate matches without comparing every pair, and a candidate counts as a
+# duplicate when the estimated Jaccard similarity is at least `threshold`.
+# The first chunk seen is kept and the sources of its duplicates are merged
+# into its metadata under 'duplicate_sources'.
+#
+#   near_dups = NearDuplicateFilter()
+#   docs = list(near_dups.filter(text_splitter.split_documents(documents)))
+class NearDuplicateFilter:
+
+    def __init__(self, threshold=0.85, num_perm=64, bands=16, shingle_size=5, seed=1):
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+                      for _ in range(num_perm)]
+        self.threshold = threshold
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.kept = {}  # key -> (document, signature)
+        self.duplicates = 0
+        self._next_key = 0
+
+    def signature(self, text):
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles(text, self.shingle_size)]
+        return tuple(min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes)
+                     for a, b in self.perms)
+
+    def _bands(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def _similarity(self, sig1, sig2):
+        return sum(x == y for x, y in zip(sig1, sig2)) / len(sig1)
+
+    # Returns the key of the chunk `doc` duplicates (after merging its source
+    # into that chunk's metadata), or None if it is new - then it is kept
+    # under `key` (defaults to a running number).
+    def check(self, doc, key=None):
+        signature = self.signature(doc.page_content)
+        seen = set()
+        for band, part in self._bands(signature):
+            for other in self.buckets[band].get(part, ()):
+                if other in seen:
+                    continue
+                seen.add(other)
+                kept_doc, kept_signature = self.kept[other]
+                if self._similarity(signature, kept_signature) >= self.threshold:
+                    self._merge(kept_doc, doc)
+                    self.duplicates += 1
+                    return other
+
+        if key is None:
+            key, self._next_key = self._next_key, self._next_key + 1
+        self.add(key, signature, doc)
+        return None
+
+    # keep a chunk under `key` without checking it, e.g. one stored in an
+    # earlier run, from its saved signature
+    def add(self, key, signature, doc):
+        signature = tuple(signature)
+        self.kept[key] = (doc, signature)
+        for band, part in self._bands(signature):
+            self.buckets[band][part].append(key)
+
+    # the kept chunk (its metadata has the merged 'duplicate_sources') and signature
+    def get(self, key):
+        return self.kept[key]
+
+    # forget a kept chunk, e.g. because it never made it into the store
+    def discard(self, key):
+        if key not in self.kept:
+            return
+        _, signature = self.kept.pop(key)
+        for band, part in self._bands(signature):
+            self.buckets[band][part].remove(key)
+
+    def _merge(self, kept_doc, duplicate_doc):
+        source = duplicate_doc.metadata.get('source')
+        if not source or source == kept_doc.metadata.get('source'):
+            return
+        # vector stores like Chroma only take scalar metadata, hence a string
+        merged = kept_doc.metadata.get('duplicate_sources', '')
+        merged = [s for s in merged.split('; ') if s]
+        if source not in merged:
+            merged.append(source)
+        kept_doc.metadata['duplicate_sources'] = '; '.join(merged)
+
+    # yield only the chunks that aren't near-duplicates of an earlier one
+    def filter(self, docs):
+        for doc in docs:
+            if self.check(doc) is None:
+                yield doc
+
+
+def dedupe_documents(docs, **kwargs):
+    near_dups = NearDuplicateFilter(**kwargs)
+    kept = list(near_dups.filter(docs))
+    if near_dups.duplicates:
+        print(f"Dropped {near_dups.duplicates} near-duplicate chunks")
+    return kept
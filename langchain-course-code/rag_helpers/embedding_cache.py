@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+# Shared by every script/project in the course so the same chunk is only ever
+# paid for once, whichever vector store builder asks for it.
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '..', 'data', 'embedding_cache')
+
+
+def normalize_text(text):
+    # collapse runs of whitespace so re-splitting/re-loading doesn't miss the cache
+    return ' '.join(text.split())
+
+
+def cache_key(model_name, text):
+    return hashlib.sha256(f'{model_name}\n{normalize_text(text)}'.encode('utf-8')).hexdigest()
+
+
+# Wraps any embeddings object (e.g. OpenAIEmbeddings()) with a persistent cache.
+# Keys are (model, normalized text) hashes kept in a small SQLite index that maps
+# to a row in a float32 matrix on disk - one file per model, read via np.memmap.
+#
+#   embeddings = CachedEmbeddings(OpenAIEmbeddings())
+#   vectordb = Chroma.from_documents(docs, embeddings)
+class CachedEmbeddings(Embeddings):
+
+    def __init__(self, underlying, cache_dir=DEFAULT_CACHE_DIR, model_name=None):
+        self.underlying = underlying
+        self.model_name = (model_name or getattr(underlying, 'model', None)
+                           or type(underlying).__name__)
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', self.model_name)
+        self.vectors_path = os.path.join(cache_dir, f'{safe_name}.f32')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'),
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS embeddings '
+                           '(key TEXT PRIMARY KEY, model TEXT NOT NULL, row INTEGER NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS dims (model TEXT PRIMARY KEY, dim INTEGER NOT NULL)')
+        self._conn.commit()
+        row = self._conn.execute('SELECT dim FROM dims WHERE model = ?',
+                                 (self.model_name,)).fetchone()
+        self.dim = row[0] if row else None
+        self._matrix = None
+
+    # --- storage ---
+    def _rows(self):
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _vectors(self, rows):
+        # (re)map the matrix only when it has grown past what we mapped last time
+        if self._matrix is None or self._matrix.shape[0] <= max(rows):
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32,
+                                     mode='r').reshape(-1, self.dim)
+        return self._matrix[rows]
+
+    def _lookup(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), 500):  # stay below SQLite's variable limit
+            part = unique[i:i + 500]
+            marks = ','.join('?' * len(part))
+            found.update(self._conn.execute(
+                f'SELECT key, row FROM embeddings WHERE key IN ({marks})', part))
+        return found
+
+    def _store(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        # BEGIN IMMEDIATE serializes writers across processes sharing the cache
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._conn.execute('INSERT OR IGNORE INTO dims VALUES (?, ?)',
+                                   (self.model_name, self.dim))
+            start = self._rows()
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(start * 4 * self.dim)  # drop a torn write from a crashed run
+                f.write(vectors.tobytes())
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)',
+                [(key, self.model_name, start + n) for n, key in enumerate(keys)])
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    # --- Embeddings interface ---
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        keys = [cache_key(self.model_name, t) for t in texts]
+        with self._lock:
+            found = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = self.underlying.embed_documents(list(missing.values()))
+            with self._lock:
+                self._store(list(missing), new_vectors)
+                found = self._lookup(keys)
+
+        with self._lock:
+            return self._vectors([found[key] for key in keys]).tolist()
+
+    def embed_query(self, text):
+        key = cache_key(self.model_name, text)
+        with self._lock:
+            found = self._lookup([key])
+        if key not in found:
+            self.misses += 1
+            vector = self.underlying.embed_query(text)
+            with self._lock:
+                self._store([key], [vector])
+                found = self._lookup([key])
+        else:
+            self.hits += 1
+        with self._lock:
+            return self._vectors([found[key]])[0].tolist()
@@ -0,0 +1,156 @@
+import gzip
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from langchain.schema import BaseRetriever, Document
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+# identifiers like invoice IDs or policy numbers (H12345678TX): tokens of 5+
+# characters with digits in them - what dense embeddings tend to miss
+def looks_like_identifier(token):
+    has_digit = any(c.isdigit() for c in token)
+    return has_digit and len(token) >= 5
+
+
+# A small BM25 inverted index over the same chunks as the vector store, saved as
+# gzipped JSON next to it (e.g. ./data/bm25.json.gz beside the Chroma files).
+class BM25Index:
+
+    def __init__(self, docs=None, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = []                     # [(page_content, metadata)]
+        self.lengths = []
+        self.postings = defaultdict(dict)  # term -> {doc number: term frequency}
+        for doc in docs or []:
+            self.add(doc.page_content, doc.metadata)
+
+    def add(self, text, metadata=None):
+        n = len(self.docs)
+        tokens = tokenize(text)
+        self.docs.append((text, metadata or {}))
+        self.lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.postings[term][n] = tf
+
+    @classmethod
+    def from_chroma(cls, vectordb, **kwargs):
+        stored = vectordb.get(include=['documents', 'metadatas'])
+        index = cls(**kwargs)
+        for text, metadata in zip(stored['documents'], stored['metadatas']):
+            index.add(text, metadata)
+        return index
+
+    # the postings and lengths are saved too, so loading doesn't tokenize the
+    # corpus again; a posting list is stored as [doc number, tf] pairs
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'docs': self.docs, 'lengths': self.lengths,
+                       'postings': {term: list(postings.items())
+                                    for term, postings in self.postings.items()}}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(k1=data['k1'], b=data['b'])
+        if 'postings' not in data:  # written before the postings were saved
+            for text, metadata in data['docs']:
+                index.add(text, metadata)
+            return index
+        index.docs = [(text, metadata) for text, metadata in data['docs']]
+        index.lengths = data['lengths']
+        for term, postings in data['postings'].items():
+            index.postings[term] = dict(postings)
+        return index
+
+    def _document(self, n):
+        text, metadata = self.docs[n]
+        return Document(page_content=text, metadata=dict(metadata))
+
+    def _scores(self, query):
+        scores = defaultdict(float)
+        if not self.docs:
+            return scores
+        avg_len = sum(self.lengths) / len(self.lengths)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for n, tf in postings.items():
+                norm = 1 - self.b + self.b * self.lengths[n] / avg_len
+                scores[n] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def _top(self, scores, candidates, k):
+        best = sorted(candidates, key=lambda n: (-scores[n], n))[:k]
+        return [self._document(n) for n in best]
+
+    def search(self, query, k=4):
+        scores = self._scores(query)
+        return self._top(scores, scores, k)
+
+    # chunks containing every identifier-like token of the query (empty if the
+    # query has none, or no chunk has them all)
+    def exact_match(self, query, k=4):
+        identifiers = [t for t in set(tokenize(query)) if looks_like_identifier(t)]
+        if not identifiers:
+            return []
+        matches = None
+        for term in identifiers:
+            docs = set(self.postings.get(term, ()))
+            matches = docs if matches is None else matches & docs
+        if not matches:
+            return []
+        return self._top(self._scores(query), matches, k)
+
+
+def _doc_key(doc):
+    return (doc.page_content, doc.metadata.get('source'), doc.metadata.get('page'))
+
+
+# Combines dense search (any vector store retriever) with the BM25 index using
+# reciprocal-rank fusion. Both searches run at the same time; a query with an
+# exact identifier hit (an invoice ID, a policy number...) is answered straight
+# from the lexical index, without embedding the query at all.
+#
+#   retriever = HybridRetriever(vector_retriever=vectordb.as_retriever(search_kwargs={'k': 6}),
+#                               bm25_index=BM25Index.from_chroma(vectordb), k=6)
+class HybridRetriever(BaseRetriever):
+    vector_retriever: BaseRetriever
+    bm25_index: Any
+    k: int = 4
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        exact = self.bm25_index.exact_match(query, k=self.k)
+        if exact:
+            return exact
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            dense_future = pool.submit(self.vector_retriever.get_relevant_documents, query)
+            lexical = self.bm25_index.search(query, k=self.k)
+            dense = dense_future.result()
+
+        scores, docs = defaultdict(float), {}
+        for results in (dense, lexical):
+            for rank, doc in enumerate(results):
+                key = _doc_key(doc)
+                scores[key] += 1 / (self.rrf_k + rank + 1)
+                docs.setdefault(key, doc)
+        best = sorted(scores, key=lambda key: -scores[key])[:self.k]
+        return [docs[key] for key in best]
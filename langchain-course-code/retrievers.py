@@ -9,13 +9,16 @@ from langchain.chat_models import ChatOpenAI
 from langchain.document_loaders import PyPDFLoader
 from langchain.embeddings import OpenAIEmbeddings 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rag_helpers.embedding_cache import CachedEmbeddings
+from rag_helpers.answer_cache import CachedRetrievalQA
+from rag_helpers.hybrid_retriever import BM25Index, HybridRetriever
 
 load_dotenv(find_dotenv())
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 #==== Using OpenAI Chat API =======
 llm_model = "gpt-3.5-turbo"
-embeddings = OpenAIEmbeddings()
+embeddings = CachedEmbeddings(OpenAIEmbeddings()) # cached on disk, see rag_helpers/
 
 llm = ChatOpenAI(temperature=0.0, model=llm_model) #changed to openAI
 
@@ -50,8 +53,11 @@ vector_store = Chroma(persist_directory=persist_directory,
                       embedding_function=embeddings)
 
 
-# make a retriever
-retriever = vector_store.as_retriever(search_kwargs={"k": 2})
+# make a retriever - dense search fused with a BM25 keyword index kept next to the db
+bm25_index = BM25Index.from_chroma(vector_store)
+bm25_index.save(persist_directory + 'bm25.json.gz')
+retriever = HybridRetriever(vector_retriever=vector_store.as_retriever(search_kwargs={"k": 2}),
+                            bm25_index=bm25_index, k=2)
 docs = retriever.get_relevant_documents("Tell me more about ReAct prompting")
 # print(retriever.search_type)
 print(docs[0].page_content)
@@ -67,6 +73,8 @@ qa_chain = RetrievalQA.from_chain_type(
     return_source_documents=True
     
 )
+# cache answers by (query, retrieved chunks, prompt, model) - see rag_helpers/
+qa_chain = CachedRetrievalQA(qa_chain)
 
 ## Cite sources - helper function to prettyfy responses
 def process_llm_response(llm_response):
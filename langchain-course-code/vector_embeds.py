@@ -5,6 +5,7 @@ from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings 
 from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rag_helpers.embedding_cache import CachedEmbeddings
 
 
 load_dotenv(find_dotenv())
@@ -13,7 +14,7 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 #==== Using OpenAI Chat API =======
 llm_model = "gpt-3.5-turbo"
 llm = ChatOpenAI(temperature=0.0, model=llm_model) 
-embeddings = OpenAIEmbeddings()
+embeddings = CachedEmbeddings(OpenAIEmbeddings()) # cached on disk, see rag_helpers/
 
 # 1. Load a pdf file
 loader = PyPDFLoader("./data/react-paper.pdf")